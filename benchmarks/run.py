@@ -0,0 +1,350 @@
+"""
+Benchmark suite for the hot paths of the toolbox
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import logging
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.synthetic import generate_dataset, generate_features
+from src.utils.image_loader import ImageLoader, ShardedImageLoader
+from src.utils.shards import read_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def time_call(func: Callable, repeat: int = 3, items: Optional[int] = None, setup: Optional[Callable] = None) -> Dict:
+    """
+    Times func over several runs
+
+    Args:
+        func: Callable to time; receives the result of setup if given
+        repeat: Number of timed runs
+        items: Number of items processed per run, to report a throughput
+        setup: Optional untimed callable run before every run
+
+    Returns:
+        Dictionary with the individual runs and their min/median/mean in seconds
+    """
+    runs = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        runs.append(time.perf_counter() - start)
+
+    result = {
+        'runs': runs,
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.mean(runs),
+    }
+    if items:
+        result['items'] = items
+        result['items_per_second'] = items / result['median'] if result['median'] > 0 else None
+    return result
+
+
+class BenchmarkSuite:
+    def __init__(
+        self,
+        work_dir: str,
+        images_per_class: int = 200,
+        num_classes: int = 5,
+        ransac_rows: List[int] = (10_000, 100_000),
+        ransac_sample_ratio: float = 0.01,
+        ransac_threshold_iter: int = 50,
+        feature_dim: int = 64,
+        repeat: int = 3,
+        seed: int = 0
+    ):
+        """
+        Reproducible benchmarks of ImageLoader, tar shards, mahalanobis, RANSACNN and FeatureExtractor
+
+        RANSACNN compares every row with a sample of sample_ratio * rows rows, so
+        the 1M-row case needs a small ratio (e.g. 0.001) to fit in memory.
+
+        Args:
+            work_dir: Directory receiving the synthetic dataset, shards and split copies
+            images_per_class: Images per synthetic class
+            num_classes: Number of synthetic classes
+            ransac_rows: Feature matrix sizes used for RANSACNN.detect
+            ransac_sample_ratio: sample_ratio passed to RANSACNN.detect
+            ransac_threshold_iter: threshold_iter passed to RANSACNN.detect
+            feature_dim: Dimension of the synthetic feature vectors
+            repeat: Number of timed runs per benchmark
+            seed: Seed of all generated data
+        """
+        self.work_dir = Path(work_dir)
+        self.images_per_class = images_per_class
+        self.num_classes = num_classes
+        self.ransac_rows = list(ransac_rows)
+        self.ransac_sample_ratio = ransac_sample_ratio
+        self.ransac_threshold_iter = ransac_threshold_iter
+        self.feature_dim = feature_dim
+        self.repeat = repeat
+        self.seed = seed
+        self.dataset_root = self.work_dir / "dataset"
+        self.results: Dict[str, Dict] = {}
+
+    def config(self) -> Dict:
+        return {
+            'images_per_class': self.images_per_class,
+            'num_classes': self.num_classes,
+            'ransac_rows': self.ransac_rows,
+            'ransac_sample_ratio': self.ransac_sample_ratio,
+            'ransac_threshold_iter': self.ransac_threshold_iter,
+            'feature_dim': self.feature_dim,
+            'repeat': self.repeat,
+            'seed': self.seed
+        }
+
+    def run(self, only: Optional[List[str]] = None) -> Dict:
+        """
+        Runs every benchmark (or those whose name starts with one of only)
+
+        A benchmark that fails or whose dependencies are missing is recorded
+        with an 'error' or 'skipped' entry instead of aborting the suite.
+        """
+        generate_dataset(
+            str(self.dataset_root),
+            num_classes=self.num_classes,
+            images_per_class=self.images_per_class,
+            corrupt_fraction=0.01,
+            duplicate_fraction=0.01,
+            seed=self.seed
+        )
+        num_images = self.num_classes * self.images_per_class
+
+        benchmarks = [
+            ('image_loader.scan', lambda: time_call(
+                lambda: ImageLoader(str(self.dataset_root)), self.repeat, num_images)),
+            ('image_loader.stats', self._bench_loader_stats),
+            ('image_loader.validate', lambda: time_call(
+                lambda: self._loader().validate_dataset(), self.repeat, num_images)),
+            ('image_loader.split', self._bench_split),
+            ('shards.pack', self._bench_shards_pack),
+            ('read.files', lambda: time_call(
+                lambda: [read_bytes(p) for p in self._loader().get_all_images()], self.repeat, num_images)),
+            ('read.shards_offset', lambda: time_call(
+                lambda loader: [read_bytes(p) for p in loader.get_all_images()], self.repeat, num_images,
+                setup=self._sharded_loader)),
+            ('read.shards_sequential', lambda: time_call(
+                lambda loader: sum(1 for _ in loader.iter_images()), self.repeat, num_images,
+                setup=self._sharded_loader)),
+            ('mahalanobis.fit', self._bench_mahalanobis_fit),
+            ('mahalanobis.detect', self._bench_mahalanobis_detect),
+        ]
+        benchmarks += [(f'ransacnn.detect.{rows}', self._ransac_bench(rows)) for rows in self.ransac_rows]
+        benchmarks.append(('feature_extractor.batch_extract', self._bench_feature_extractor))
+
+        for name, bench in benchmarks:
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            logger.info(f"Running {name}")
+            try:
+                self.results[name] = bench()
+            except ImportError as e:
+                self.results[name] = {'skipped': str(e)}
+            except Exception as e:
+                logger.exception(f"Benchmark {name} failed")
+                self.results[name] = {'error': repr(e)}
+
+        return {
+            'meta': {
+                'timestamp': time.time(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'numpy': np.__version__,
+                'config': self.config()
+            },
+            'results': self.results
+        }
+
+    def _loader(self) -> ImageLoader:
+        if not hasattr(self, '_cached_loader'):
+            self._cached_loader = ImageLoader(str(self.dataset_root))
+        return self._cached_loader
+
+    def _bench_loader_stats(self) -> Dict:
+        loader = self._loader()
+
+        def stats():
+            loader.map_class_folders()
+            loader.get_dataset_stats()
+
+        return time_call(stats, self.repeat, self.num_classes * self.images_per_class)
+
+    def _bench_split(self) -> Dict:
+        splits_dir = self.dataset_root.parent / "splits"
+
+        def clean():
+            # split() skips files already copied, so start from scratch every run
+            shutil.rmtree(splits_dir, ignore_errors=True)
+            return self._loader()
+
+        return time_call(lambda loader: loader.split(), self.repeat,
+                         self.num_classes * self.images_per_class, setup=clean)
+
+    def _sharded_loader(self) -> ShardedImageLoader:
+        if not hasattr(self, '_cached_sharded_loader'):
+            shards_dir = self.work_dir / "shards"
+            shutil.rmtree(shards_dir, ignore_errors=True)
+            self._cached_sharded_loader = ShardedImageLoader.pack(self._loader(), str(shards_dir),
+                                                                  max_bytes=16 << 20)
+        return self._cached_sharded_loader
+
+    def _bench_shards_pack(self) -> Dict:
+        shards_dir = self.work_dir / "shards_pack"
+
+        def clean():
+            shutil.rmtree(shards_dir, ignore_errors=True)
+            return self._loader()
+
+        return time_call(lambda loader: ShardedImageLoader.pack(loader, str(shards_dir), max_bytes=16 << 20),
+                         self.repeat, self.num_classes * self.images_per_class, setup=clean)
+
+    def _bench_mahalanobis_fit(self) -> Dict:
+        from src.outliers.mahalanobis import mahalanobis
+
+        valid = ImageLoader(str(self.dataset_root))
+        # mahalanobis reads every image, so leave the corrupt ones out
+        corrupt = self._corrupt_paths()
+        valid.dataset_index = {ext: [p for p in paths if p not in corrupt]
+                               for ext, paths in valid.dataset_index.items()}
+        valid.map_class_folders()
+        self._valid_loader = valid
+        return time_call(lambda: mahalanobis(valid), self.repeat,
+                         sum(len(paths) for paths in valid.dataset_index.values()))
+
+    def _bench_mahalanobis_detect(self) -> Dict:
+        from src.outliers.mahalanobis import mahalanobis
+
+        if not hasattr(self, '_valid_loader'):
+            self._bench_mahalanobis_fit()
+        detector = mahalanobis(self._valid_loader)
+        return time_call(lambda: detector.detect(), self.repeat, len(detector.features))
+
+    def _ransac_bench(self, rows: int) -> Callable[[], Dict]:
+        def bench():
+            from src.outliers.ransacnn import RANSACNN
+
+            features = generate_features(rows, dim=self.feature_dim, seed=self.seed)
+
+            def detect():
+                np.random.seed(self.seed)
+                RANSACNN(features.copy()).detect(sample_ratio=self.ransac_sample_ratio,
+                                                 threshold_iter=self.ransac_threshold_iter)
+
+            return time_call(detect, self.repeat, rows)
+        return bench
+
+    def _bench_feature_extractor(self) -> Dict:
+        from src.utils.feature_extractor import FeatureExtractor
+
+        extractor = FeatureExtractor()
+        paths = self._valid_paths()[:64]
+        extractor.batch_extract(paths[:2])  # Warm up graph tracing
+        return time_call(lambda: extractor.batch_extract(paths), self.repeat, len(paths))
+
+    def _corrupt_paths(self) -> set:
+        manifest_path = self.dataset_root.parent / f"{self.dataset_root.name}.manifest.json"
+        return set(json.loads(manifest_path.read_text())['corrupt'])
+
+    def _valid_paths(self) -> List[str]:
+        corrupt = self._corrupt_paths()
+        return [p for p in self._loader().get_all_images() if p not in corrupt]
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.2) -> Dict[str, Dict]:
+    """
+    Compares median times with a baseline run
+
+    Args:
+        results: Output of BenchmarkSuite.run
+        baseline: Earlier output of BenchmarkSuite.run
+        tolerance: Allowed slowdown ratio before a benchmark counts as a regression
+
+    Returns:
+        Per benchmark present in both runs: baseline and current medians, their ratio
+        and whether it regressed
+    """
+    comparison = {}
+    for name, current in results['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or 'median' not in previous or 'median' not in current:
+            continue
+        ratio = current['median'] / previous['median'] if previous['median'] > 0 else float('inf')
+        comparison[name] = {
+            'baseline': previous['median'],
+            'current': current['median'],
+            'ratio': ratio,
+            'regression': ratio > 1 + tolerance
+        }
+    return comparison
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the image-stats-toolbox hot paths")
+    parser.add_argument("--output", default="bench_results.json", help="JSON file receiving the results")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--save-baseline", help="Also write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before failing (0.2 = 20%%)")
+    parser.add_argument("--work-dir", help="Directory for the synthetic dataset (defaults to a temporary one)")
+    parser.add_argument("--images-per-class", type=int, default=200)
+    parser.add_argument("--classes", type=int, default=5)
+    parser.add_argument("--ransac-rows", default="10000,100000", help="Comma-separated RANSACNN matrix sizes")
+    parser.add_argument("--ransac-sample-ratio", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="Comma-separated benchmark name prefixes to run")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        suite = BenchmarkSuite(
+            args.work_dir or tmp_dir,
+            images_per_class=args.images_per_class,
+            num_classes=args.classes,
+            ransac_rows=[int(rows) for rows in args.ransac_rows.split(",") if rows],
+            ransac_sample_ratio=args.ransac_sample_ratio,
+            repeat=args.repeat
+        )
+        results = suite.run(only=args.only.split(",") if args.only else None)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results['comparison'] = compare(results, baseline, args.tolerance)
+        for name, entry in results['comparison'].items():
+            marker = "REGRESSION" if entry['regression'] else "ok"
+            logger.info(f"{name}: {entry['baseline']:.4f}s -> {entry['current']:.4f}s "
+                        f"(x{entry['ratio']:.2f}) {marker}")
+            if entry['regression']:
+                exit_code = 1
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=4)
+        logger.info(f"Results written to {path}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
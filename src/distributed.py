@@ -0,0 +1,557 @@
+"""
+Sharded map-reduce execution across processes and nodes
+
+A job partitions an ImageLoader index into deterministic shards and keeps a
+file-based work queue in a directory on a shared filesystem. Workers on any
+number of machines claim shards by atomically renaming queue files, compute
+features, pixel statistics and perceptual hashes per shard, and the results
+are merged into the global inputs of mahalanobis and RANSACNN.
+
+Usage:
+    python -m src.distributed submit index.json /shared/job --shards 64 --tasks features,stats,hashes
+    python -m src.distributed worker /shared/job --processes 4     # on every node
+    python -m src.distributed status /shared/job
+    python -m src.distributed merge /shared/job
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.utils.feature_job import FeatureExtractionJob, PipelinedFeatureExtractionJob, create_extractor
+from src.utils.image_io import open_image
+from src.utils.image_loader import ImageLoader
+from src.utils.moments import RunningMoments
+from src.utils.pixel_stats import PixelStatsAccumulator, accumulate_paths
+from src.utils.profiling import stage
+
+logger = logging.getLogger(__name__)
+
+TASKS = ('features', 'stats', 'hashes')
+
+
+class LeaseLost(RuntimeError):
+    """Raised when a worker's claim on a shard expired and the shard was requeued"""
+
+
+def difference_hash(path: str, hash_size: int = 8) -> str:
+    """
+    Perceptual difference hash of an image as a hex string
+
+    Near-identical images (re-encoded, resized) get the same or a close hash.
+    """
+    img = open_image(path, target_size=(hash_size + 1, hash_size), mode='L')
+    pixels = np.asarray(img.resize((hash_size + 1, hash_size)), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+class ShardedJob:
+    def __init__(self, job_dir: str):
+        """
+        Opens an existing job directory created by ShardedJob.create
+
+        Layout:
+            job.json             parameters of the job
+            shards/<id>.json     image paths of every shard
+            queue/todo/<id>      shards waiting for a worker
+            queue/claimed/<id>@<worker>  shards being processed (mtime is the lease heartbeat)
+            results/<id>/        outputs of finished shards
+            results/<id>.<worker>.partial/  outputs of a shard being processed
+            merged/              global outputs written by merge()
+        """
+        self.job_dir = Path(job_dir)
+        with open(self.job_dir / 'job.json') as f:
+            self.config = json.load(f)
+        self.todo_dir = self.job_dir / 'queue' / 'todo'
+        self.claimed_dir = self.job_dir / 'queue' / 'claimed'
+        self.results_dir = self.job_dir / 'results'
+
+    @classmethod
+    def create(
+        cls,
+        job_dir: str,
+        image_loader: ImageLoader,
+        num_shards: int = 16,
+        tasks: List[str] = TASKS,
+        extractor: str = 'src.utils.feature_extractor:FeatureExtractor',
+        extractor_options: Optional[Dict] = None,
+        batch_size: int = 32,
+        stats_max_size: Optional[int] = 256,
+        lease_seconds: float = 600
+    ) -> 'ShardedJob':
+        """
+        Partitions the index into contiguous shards and fills the work queue
+
+        Shards are contiguous runs of the index order, so the same index and
+        shard count always give the same shards and merged rows keep the index order.
+
+        Args:
+            job_dir: Directory on a filesystem shared by all workers
+            image_loader: ImageLoader (or one restored with load_index) to partition
+            num_shards: Number of shards
+            tasks: Subset of 'features', 'stats' and 'hashes' computed per shard
+            extractor: 'module:Class' of the feature extractor
+            extractor_options: Keyword arguments of the feature extractor
+            batch_size: Feature extraction batch size
+            stats_max_size: Longest side images are reduced to for pixel statistics
+            lease_seconds: Time after which a shard whose worker stopped heartbeating is requeued
+        """
+        unknown = set(tasks) - set(TASKS)
+        if unknown:
+            raise ValueError(f"Unknown tasks: {sorted(unknown)}")
+        job_dir = Path(job_dir)
+        if (job_dir / 'job.json').exists():
+            raise FileExistsError(f"{job_dir} already holds a job")
+
+        paths = image_loader.get_all_images()
+        num_shards = max(1, min(num_shards, len(paths)))
+        bounds = np.linspace(0, len(paths), num_shards + 1).astype(int)
+
+        for directory in ('shards', 'queue/todo', 'queue/claimed', 'results'):
+            (job_dir / directory).mkdir(parents=True, exist_ok=True)
+        for shard_id in range(num_shards):
+            with open(job_dir / 'shards' / f"{shard_id:05d}.json", 'w') as f:
+                json.dump({'start': int(bounds[shard_id]), 'paths': paths[bounds[shard_id]:bounds[shard_id + 1]]}, f)
+
+        config = {
+            'root_path': str(image_loader.root_path),
+            'num_shards': num_shards,
+            'num_images': len(paths),
+            'tasks': list(tasks),
+            'extractor': extractor,
+            'extractor_options': extractor_options or {},
+            'batch_size': batch_size,
+            'stats_max_size': stats_max_size,
+            'lease_seconds': lease_seconds,
+            'created': time.time()
+        }
+        # job.json is written last: its presence marks a fully created job
+        with open(job_dir / 'job.json.tmp', 'w') as f:
+            json.dump(config, f, indent=4)
+        for shard_id in range(num_shards):
+            (job_dir / 'queue' / 'todo' / f"{shard_id:05d}").touch()
+        os.replace(job_dir / 'job.json.tmp', job_dir / 'job.json')
+        return cls(str(job_dir))
+
+    def status(self) -> Dict[str, int]:
+        """Counts shards per state"""
+        done = sum(1 for path in self.results_dir.iterdir() if path.is_dir() and not path.name.endswith('.partial'))
+        return {
+            'todo': len(os.listdir(self.todo_dir)),
+            'claimed': len(os.listdir(self.claimed_dir)),
+            'done': done,
+            'total': self.config['num_shards']
+        }
+
+    def claim(self, worker_id: str) -> Optional[str]:
+        """Atomically takes a shard from the queue; returns its id, or None when the queue is empty"""
+        self.requeue_stale()
+        for name in sorted(os.listdir(self.todo_dir)):
+            try:
+                os.rename(self.todo_dir / name, self.claimed_dir / f"{name}@{worker_id}")
+                return name
+            except FileNotFoundError:
+                continue  # Another worker was faster
+        return None
+
+    def requeue_stale(self) -> None:
+        """Puts back shards whose worker stopped refreshing its lease"""
+        deadline = time.time() - self.config['lease_seconds']
+        for name in os.listdir(self.claimed_dir):
+            try:
+                if os.path.getmtime(self.claimed_dir / name) < deadline:
+                    os.rename(self.claimed_dir / name, self.todo_dir / name.split('@')[0])
+                    logger.warning(f"Requeued shard {name} after its lease expired")
+            except FileNotFoundError:
+                continue
+
+    def run_worker(self, worker_id: Optional[str] = None, wait: bool = False) -> int:
+        """
+        Processes shards until the queue is empty
+
+        Args:
+            worker_id: Name of the worker (defaults to host-pid-random)
+            wait: Keep polling while other workers still hold shards, to take over expired leases
+
+        Returns:
+            Number of shards processed by this worker
+        """
+        worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        processed = 0
+        extractor = None
+        while True:
+            shard_id = self.claim(worker_id)
+            if shard_id is None:
+                if wait and self.status()['claimed']:
+                    time.sleep(min(30, self.config['lease_seconds'] / 4))
+                    continue
+                return processed
+
+            claim_path = self.claimed_dir / f"{shard_id}@{worker_id}"
+            stop = threading.Event()
+            lost = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(claim_path, stop, lost), daemon=True)
+            heartbeat.start()
+            try:
+                if extractor is None and 'features' in self.config['tasks']:
+                    # Loaded once per worker and reused for every shard
+                    extractor = create_extractor(self.config['extractor'], self.config['extractor_options'])
+                self.process_shard(shard_id, extractor, worker_id=worker_id, lost=lost)
+                processed += 1
+            except BaseException as e:
+                if isinstance(e, LeaseLost) or (isinstance(e, Exception) and not claim_path.exists()):
+                    # The shard now belongs to another worker: drop this attempt and move on
+                    logger.warning(f"Lost the lease of shard {shard_id}, abandoning it")
+                    shutil.rmtree(self._partial_dir(shard_id, worker_id), ignore_errors=True)
+                    continue
+                # Give the shard back right away instead of waiting for the lease to expire
+                try:
+                    os.rename(claim_path, self.todo_dir / shard_id)
+                except FileNotFoundError:
+                    pass
+                raise
+            finally:
+                stop.set()
+                heartbeat.join()
+            try:
+                os.remove(claim_path)
+            except FileNotFoundError:
+                pass
+
+    def _heartbeat(self, claim_path: Path, stop: threading.Event, lost: threading.Event) -> None:
+        interval = self.config['lease_seconds'] / 3
+        while not stop.wait(interval):
+            try:
+                os.utime(claim_path)
+            except FileNotFoundError:
+                # The lease expired and the shard was requeued
+                lost.set()
+                return
+
+    def _partial_dir(self, shard_id: str, worker_id: str) -> Path:
+        return self.results_dir / f"{shard_id}.{worker_id}.partial"
+
+    def _seed_partial(self, shard_id: str, partial_dir: Path) -> None:
+        """
+        Copies the most advanced feature checkpoint left by an earlier claimant of the shard
+
+        The checkpoint is copied before the matrix: every row it counts was
+        flushed before it was written, so the copy is consistent even if its
+        owner is still running.
+        """
+        best, best_completed = None, 0
+        for candidate in self.results_dir.glob(f"{shard_id}.*.partial"):
+            if candidate == partial_dir:
+                continue
+            try:
+                with open(candidate / 'features' / FeatureExtractionJob.CHECKPOINT_FILE) as f:
+                    completed = json.load(f)['completed']
+            except (OSError, ValueError, KeyError):
+                continue
+            if completed > best_completed:
+                best, best_completed = candidate, completed
+        if best is None:
+            return
+
+        target = partial_dir / 'features'
+        target.mkdir(parents=True, exist_ok=True)
+        try:
+            for name in (FeatureExtractionJob.CHECKPOINT_FILE, FeatureExtractionJob.PATHS_FILE,
+                         FeatureExtractionJob.FEATURES_FILE):
+                shutil.copyfile(best / 'features' / name, target / name)
+        except OSError:
+            # Its owner removed it meanwhile: start from scratch
+            shutil.rmtree(target, ignore_errors=True)
+            return
+        logger.info(f"Resuming shard {shard_id} from {best.name} at row {best_completed}")
+
+    def _remove_abandoned(self, shard_id: str) -> None:
+        """Removes partial directories of the shard whose worker no longer holds a claim"""
+        claimants = {name.split('@', 1)[1] for name in os.listdir(self.claimed_dir)
+                     if name.split('@', 1)[0] == shard_id}
+        for candidate in self.results_dir.glob(f"{shard_id}.*.partial"):
+            if candidate.name[len(shard_id) + 1:-len('.partial')] not in claimants:
+                shutil.rmtree(candidate, ignore_errors=True)
+
+    def process_shard(self, shard_id: str, extractor=None, worker_id: str = 'local',
+                      lost: Optional[threading.Event] = None) -> None:
+        """
+        Computes the configured tasks of one shard into results/<id>
+
+        Outputs are written to results/<id>.<worker_id>.partial, so two workers
+        holding the same shard after a lease takeover never share files, and
+        renamed when complete. A new claimant starts from the feature
+        checkpoint of an earlier one, so a shard picked up again after a crash
+        resumes where it stopped.
+
+        Args:
+            shard_id: Shard to process
+            extractor: Feature extractor, required for the 'features' task
+            worker_id: Name of the worker holding the claim
+            lost: Event set once the claim was taken away; processing then stops with LeaseLost
+        """
+        final_dir = self.results_dir / shard_id
+        if final_dir.exists():
+            return
+        claim_path = self.claimed_dir / f"{shard_id}@{worker_id}"
+
+        def check_lease():
+            if lost is not None and (lost.is_set() or not claim_path.exists()):
+                lost.set()
+                raise LeaseLost(f"Shard {shard_id} was requeued while {worker_id} processed it")
+
+        partial_dir = self._partial_dir(shard_id, worker_id)
+        if not partial_dir.exists():
+            partial_dir.mkdir()
+            if 'features' in self.config['tasks']:
+                self._seed_partial(shard_id, partial_dir)
+        with open(self.job_dir / 'shards' / f"{shard_id}.json") as f:
+            paths = json.load(f)['paths']
+
+        with stage('distributed.shard', items=len(paths)):
+            if 'features' in self.config['tasks']:
+                moments = RunningMoments()
+
+                def on_batch(start, rows):
+                    check_lease()
+                    moments.update(rows)
+
+                PipelinedFeatureExtractionJob(
+                    extractor, None, str(partial_dir / 'features'),
+                    batch_size=self.config['batch_size'],
+                    image_paths=paths,
+                    on_batch=on_batch
+                ).run()
+                moments.save(str(partial_dir / 'moments.npz'))
+
+            if 'stats' in self.config['tasks']:
+                by_class = defaultdict(list)
+                for path in paths:
+                    by_class[Path(path).parent.name].append(path)
+                stats = {}
+                for class_name, class_paths in by_class.items():
+                    check_lease()
+                    stats[class_name] = accumulate_paths(class_paths, self.config['stats_max_size'])
+                with open(partial_dir / 'stats.json', 'w') as f:
+                    json.dump(stats, f)
+
+            if 'hashes' in self.config['tasks']:
+                hashes = {}
+                for i, path in enumerate(paths):
+                    if i % self.config['batch_size'] == 0:
+                        check_lease()
+                    try:
+                        hashes[path] = difference_hash(path)
+                    except Exception as e:
+                        logger.debug(f"Could not hash {path}: {e}")
+                with open(partial_dir / 'hashes.json', 'w') as f:
+                    json.dump(hashes, f)
+
+        # Only the current owner of the claim may publish the results
+        check_lease()
+        try:
+            os.rename(partial_dir, final_dir)
+        except OSError:
+            # Another worker published the shard first
+            shutil.rmtree(partial_dir, ignore_errors=True)
+        self._remove_abandoned(shard_id)
+        logger.info(f"Finished shard {shard_id} ({len(paths)} images)")
+
+    def merge(self) -> Dict:
+        """
+        Reduces the per-shard results into merged/
+
+        Writes features.npy (rows in index order, NaN for unreadable images),
+        paths.json, moments.npz, pixel_stats.json and hashes.json with the
+        groups of images sharing a hash.
+
+        Returns:
+            Summary of what was merged
+        """
+        status = self.status()
+        if status['done'] < status['total']:
+            raise RuntimeError(f"Only {status['done']}/{status['total']} shards are finished")
+
+        merged_dir = self.job_dir / 'merged'
+        merged_dir.mkdir(exist_ok=True)
+        shard_ids = [f"{i:05d}" for i in range(self.config['num_shards'])]
+        summary = {'num_images': self.config['num_images']}
+
+        if 'features' in self.config['tasks']:
+            features = None
+            paths = []
+            moments = RunningMoments()
+            failed = []
+            for shard_id in shard_ids:
+                shard = FeatureExtractionJob.load(str(self.results_dir / shard_id / 'features'))
+                if features is None:
+                    features = np.lib.format.open_memmap(
+                        merged_dir / 'features.npy', mode='w+', dtype=np.float32,
+                        shape=(self.config['num_images'], shard['features'].shape[1])
+                    )
+                features[len(paths):len(paths) + len(shard['paths'])] = shard['features']
+                failed.extend(len(paths) + i for i in shard['failed'])
+                paths.extend(shard['paths'])
+                moments.merge(RunningMoments.load(str(self.results_dir / shard_id / 'moments.npz')))
+            features.flush()
+            moments.save(str(merged_dir / 'moments.npz'))
+            with open(merged_dir / 'paths.json', 'w') as f:
+                json.dump(paths, f)
+            summary['features'] = {'shape': list(features.shape), 'failed': failed}
+
+        if 'stats' in self.config['tasks']:
+            per_class: Dict[str, PixelStatsAccumulator] = {}
+            for shard_id in shard_ids:
+                with open(self.results_dir / shard_id / 'stats.json') as f:
+                    for class_name, state in json.load(f).items():
+                        accumulator = PixelStatsAccumulator.from_dict(state)
+                        if class_name in per_class:
+                            per_class[class_name].merge(accumulator)
+                        else:
+                            per_class[class_name] = accumulator
+            overall = PixelStatsAccumulator()
+            for accumulator in per_class.values():
+                overall.merge(accumulator)
+            stats = {
+                'overall': overall.summary(),
+                'classes': {name: accumulator.summary() for name, accumulator in per_class.items()}
+            }
+            with open(merged_dir / 'pixel_stats.json', 'w') as f:
+                json.dump(stats, f)
+            summary['stats'] = {'classes': len(per_class)}
+
+        if 'hashes' in self.config['tasks']:
+            hashes = {}
+            for shard_id in shard_ids:
+                with open(self.results_dir / shard_id / 'hashes.json') as f:
+                    hashes.update(json.load(f))
+            groups = defaultdict(list)
+            for path, value in hashes.items():
+                groups[value].append(path)
+            duplicates = [group for group in groups.values() if len(group) > 1]
+            with open(merged_dir / 'hashes.json', 'w') as f:
+                json.dump({'hashes': hashes, 'duplicates': duplicates}, f)
+            summary['hashes'] = {'hashed': len(hashes), 'duplicate_groups': len(duplicates)}
+
+        return summary
+
+    def build_detector(self, method: str = 'mahalanobis'):
+        """
+        Creates an outlier detector on the merged features
+
+        Unreadable images (NaN rows) are left out; the detector's image_paths
+        (mahalanobis) or the returned paths stay aligned with its rows.
+
+        Returns:
+            Tuple of the detector and the paths aligned with its feature rows
+        """
+        from src.outliers.mahalanobis import mahalanobis
+        from src.outliers.ransacnn import RANSACNN
+
+        merged_dir = self.job_dir / 'merged'
+        features = np.load(merged_dir / 'features.npy', mmap_mode='r')
+        with open(merged_dir / 'paths.json') as f:
+            paths = json.load(f)
+        valid = np.flatnonzero(np.isfinite(features).all(axis=1))
+        valid_paths = [paths[i] for i in valid]
+
+        if method == 'mahalanobis':
+            moments = RunningMoments.load(str(merged_dir / 'moments.npz'))
+            detector = mahalanobis.from_features(np.asarray(features[valid]), valid_paths,
+                                                 mean=moments.mean, covariance=moments.covariance())
+        elif method == 'ransacnn':
+            detector = RANSACNN(np.asarray(features[valid]))
+        else:
+            raise ValueError(f"Unknown detection method: {method}")
+        return detector, valid_paths
+
+
+def run_workers(job_dir: str, processes: int = 1, wait: bool = False) -> None:
+    """Runs several worker processes on this node and waits for them"""
+    if processes == 1:
+        ShardedJob(job_dir).run_worker(wait=wait)
+        return
+    workers = [multiprocessing.Process(target=_worker_main, args=(job_dir, wait)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed = [worker.exitcode for worker in workers if worker.exitcode]
+    if failed:
+        raise RuntimeError(f"{len(failed)} worker processes failed")
+
+
+def _worker_main(job_dir: str, wait: bool) -> None:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ShardedJob(job_dir).run_worker(wait=wait)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Console entry point"""
+    parser = argparse.ArgumentParser(description="Sharded feature extraction, statistics and hashing")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help="Partition an index into shards and queue them")
+    submit.add_argument('index', help="Index written by ImageLoader.save_index")
+    submit.add_argument('job_dir', help="Job directory on a filesystem shared by the workers")
+    submit.add_argument('--shards', type=int, default=16)
+    submit.add_argument('--tasks', default=','.join(TASKS), help="Comma-separated subset of features,stats,hashes")
+    submit.add_argument('--extractor', default='src.utils.feature_extractor:FeatureExtractor')
+    submit.add_argument('--extractor-options', default='{}', help="JSON keyword arguments of the extractor")
+    submit.add_argument('--batch-size', type=int, default=32)
+    submit.add_argument('--lease', type=float, default=600, help="Seconds before an abandoned shard is requeued")
+
+    worker = commands.add_parser('worker', help="Process queued shards")
+    worker.add_argument('job_dir')
+    worker.add_argument('--processes', type=int, default=1)
+    worker.add_argument('--wait', action='store_true', help="Keep polling to take over abandoned shards")
+
+    status = commands.add_parser('status', help="Show the progress of a job")
+    status.add_argument('job_dir')
+
+    merge = commands.add_parser('merge', help="Merge the results of a finished job")
+    merge.add_argument('job_dir')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == 'submit':
+        job = ShardedJob.create(
+            args.job_dir,
+            ImageLoader.load_index(args.index),
+            num_shards=args.shards,
+            tasks=args.tasks.split(','),
+            extractor=args.extractor,
+            extractor_options=json.loads(args.extractor_options),
+            batch_size=args.batch_size,
+            lease_seconds=args.lease
+        )
+        print(json.dumps(job.status()))
+    elif args.command == 'worker':
+        run_workers(args.job_dir, processes=args.processes, wait=args.wait)
+    elif args.command == 'status':
+        print(json.dumps(ShardedJob(args.job_dir).status()))
+    elif args.command == 'merge':
+        print(json.dumps(ShardedJob(args.job_dir).merge()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,16 @@
 # Implementation of Mahalanobis distance on image for outlier detection
+import random
 import numpy as np
 import matplotlib.pyplot as plt
 from typing import List, Dict
 from src.outliers.outlier import Outlier
 from src.utils.image_loader import ImageLoader
+from src.utils.shards import image_source
 from skimage import io
 from scipy.linalg import inv
 from src.utils.visualisation import DatasetVisualizer
+from src.utils.embedding_viz import EmbeddingVisualizer
+from src.utils.profiling import stage
 
 class mahalanobis(Outlier):
     def __init__(self, image_loader: ImageLoader, class_name: str = None):
@@ -27,6 +31,32 @@ class mahalanobis(Outlier):
         # Computing inverse covariance matrix for Mahalanobis distance
         self.inv_covariance = inv(self.covariance)
 
+    @classmethod
+    def from_features(cls, features: np.ndarray, image_paths: List[str] = None,
+                      mean: np.ndarray = None, covariance: np.ndarray = None) -> 'mahalanobis':
+        """
+        Builds a detector on precomputed features (e.g. FeatureExtractor embeddings)
+        
+        Args:
+            features: Feature matrix, one row per image
+            image_paths: Paths aligned with the rows, for get_outlier_paths
+            mean: Precomputed mean (e.g. from RunningMoments), computed from features if omitted
+            covariance: Precomputed covariance, computed from features if omitted
+        """
+        detector = cls.__new__(cls)
+        Outlier.__init__(detector, features)
+        detector.image_loader = None
+        detector.class_name = None
+        detector.image_paths = list(image_paths) if image_paths is not None else []
+        detector.mean = mean if mean is not None else np.mean(features, axis=0)
+        detector.covariance = covariance if covariance is not None else np.cov(features, rowvar=False)
+        try:
+            detector.inv_covariance = inv(detector.covariance)
+        except np.linalg.LinAlgError:
+            # Deep features often have more dimensions than independent samples
+            detector.inv_covariance = np.linalg.pinv(detector.covariance, hermitian=True)
+        return detector
+
     def detect(self, threshold: float = 3.0) -> List[int]:
         """
         Detects outliers using Mahalanobis distance
@@ -34,14 +64,14 @@ class mahalanobis(Outlier):
         Args:
             threshold: Distance threshold for outlier detection
         """
-        distances = []
-        for x in self.features:
-            # Mahalanobis distance formula: sqrt((x-μ)ᵀ Σ⁻¹ (x-μ))
-            diff = x - self.mean
-            dist = np.sqrt(diff.dot(self.inv_covariance).dot(diff))
-            distances.append(dist)
-            
-        distances = np.array(distances)
+        with stage('mahalanobis.detect', items=len(self.features)):
+            distances = np.empty(len(self.features))
+            # Chunks keep memory flat for memmapped feature matrices
+            for start in range(0, len(self.features), 65536):
+                # Mahalanobis distance formula: sqrt((x-μ)ᵀ Σ⁻¹ (x-μ))
+                diff = np.asarray(self.features[start:start + 65536], dtype=np.float64) - self.mean
+                squared = np.einsum('ij,jk,ik->i', diff, self.inv_covariance, diff, optimize=True)
+                distances[start:start + len(diff)] = np.sqrt(np.maximum(squared, 0))
         self.outlier_scores = {i: d for i, d in enumerate(distances)}
         self.outlier_indices = [i for i, d in enumerate(distances) if d > threshold]
         return self.outlier_indices
@@ -49,9 +79,10 @@ class mahalanobis(Outlier):
     def _extract_dataset_features(self) -> np.ndarray:
         """Extract features from all images in the dataset"""
         features = []
-        for path in self.image_paths:
-            img = io.imread(path)
-            features.append(self._extract_features(img))
+        with stage('mahalanobis.features', items=len(self.image_paths), paths=self.image_paths):
+            for path in self.image_paths:
+                img = io.imread(image_source(path))
+                features.append(self._extract_features(img))
         return np.array(features)
     
     def _extract_features(self, img: np.ndarray) -> np.ndarray:
@@ -71,13 +102,14 @@ class mahalanobis(Outlier):
         """Returns the file paths of detected outlier images"""
         return [self.image_paths[i] for i in self.outlier_indices]
     
-    def visualize_outliers(self, num_samples: int = 5):
+    def visualize_outliers(self, num_samples: int = 5, output_path: str = None):
         """Displays a grid of detected outlier images for visual inspection"""
-        # Create a temporary ImageLoader instance just for visualization
-        temp_loader = ImageLoader(self.image_loader.root_path)
-        temp_loader.dataset_index = {"outliers": self.get_outlier_paths()}
-        temp_loader.class_mapping = {"outliers": self.get_outlier_paths()}
-        
-        # Use our existing visualization tool
-        DatasetVisualizer.viz(temp_loader, images_per_class=num_samples)
+        outlier_paths = self.get_outlier_paths()
+        sampled = random.sample(outlier_paths, min(num_samples, len(outlier_paths)))
+        DatasetVisualizer.viz_groups({"outliers": sampled}, images_per_class=num_samples,
+                                     output_path=output_path, title="Detected Outliers")
 
+    def visualize_embedding(self, method: str = 'pca', color_by: str = 'score', output_path: str = None):
+        """Plots the image features projected to 2D with the detected outliers highlighted"""
+        return EmbeddingVisualizer.viz_detector(self, image_paths=self.image_paths, method=method,
+                                                color_by=color_by, output_path=output_path)
@@ -4,6 +4,7 @@ import numpy as np
 from typing import List, Dict, Any
 from sklearn.metrics.pairwise import cosine_similarity
 from .outlier import Outlier
+from src.utils.profiling import stage
 
 class RANSACNN(Outlier):
     def __init__(self, features: np.ndarray):
@@ -30,10 +31,12 @@ class RANSACNN(Outlier):
         # Stage 1: Inlier Score Prediction (ISP)
         m = max(1, int(self.n_samples * sample_ratio))
         s = max(1, int(np.ceil(self.n_samples / m)))
-        inlier_scores = self._isp(m, s)
+        with stage('ransacnn.isp', items=self.n_samples):
+            inlier_scores = self._isp(m, s)
         
         # Stage 2: Threshold Sampling (TS)
-        outlier_scores = self._ts(inlier_scores, m, threshold_iter)
+        with stage('ransacnn.ts', items=self.n_samples):
+            outlier_scores = self._ts(inlier_scores, m, threshold_iter)
         
         # Store scores and determine outliers
         self.outlier_scores = {i: float(outlier_scores[i]) for i in range(self.n_samples)}
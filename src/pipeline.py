@@ -0,0 +1,352 @@
+"""
+End-to-end pipeline: scan -> extract -> detect -> act
+
+Usage:
+    python -m src.pipeline config.json
+    python -m src.pipeline config.toml --force detect --profile profile.json
+    python -m src.pipeline --print-config > config.json
+
+Every stage persists its outputs in output_dir together with a fingerprint of
+its configuration and of the upstream outputs, so a later run only redoes the
+stages whose inputs changed. Feature extraction overlaps decoding, inference
+and the accumulation of the scoring statistics through bounded queues.
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.utils.image_loader import ImageLoader, ShardedImageLoader
+from src.utils.feature_job import FeatureExtractionJob, PipelinedFeatureExtractionJob, create_extractor
+from src.utils.moments import RunningMoments
+from src.utils.profiling import instrumentation, stage
+from src.utils.shards import image_stat
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['scan', 'extract', 'detect', 'act']
+
+DEFAULT_CONFIG = {
+    'output_dir': 'pipeline_output',
+    'scan': {
+        'root': None,
+        'format': 'files',
+        'extensions': ['.jpg', '.jpeg', '.png'],
+        'recursive': True,
+        'class_name': None
+    },
+    'extract': {
+        'extractor': 'src.utils.feature_extractor:FeatureExtractor',
+        'options': {},
+        'batch_size': 32,
+        'decode_workers': 4,
+        'queue_size': 4,
+        'checkpoint_every': 10
+    },
+    'detect': {
+        'method': 'ransacnn',
+        'sample_ratio': 0.05,
+        'threshold_iter': 500,
+        'threshold': 3.0,
+        'seed': 0
+    },
+    'act': {
+        'contact_sheet': 'outliers.html',
+        'images_per_row': 8,
+        'action': 'report',
+        'move_to': None,
+        'confirm': True
+    }
+}
+
+
+def load_config(path: str) -> Dict:
+    """Reads a JSON or TOML config file and fills in the defaults"""
+    with open(path, 'rb') as f:
+        if Path(path).suffix.lower() == '.toml':
+            import tomllib
+            user_config = tomllib.load(f)
+        else:
+            user_config = json.load(f)
+
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    for key, value in user_config.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    if not config['scan']['root']:
+        raise ValueError("The config must set scan.root")
+    return config
+
+
+class Pipeline:
+    def __init__(self, config: Dict, force: Optional[List[str]] = None):
+        """
+        Runs the stages of a config, skipping those whose outputs are up to date
+
+        Args:
+            config: Configuration as returned by load_config
+            force: Stages to redo even if their outputs are up to date
+        """
+        self.config = config
+        self.force = set(force or [])
+        self.output_dir = Path(config['output_dir'])
+        self.stage_dir = self.output_dir / 'stages'
+        self.stage_dir.mkdir(parents=True, exist_ok=True)
+        self.loader: Optional[ImageLoader] = None
+
+    def run(self, until: str = 'act') -> Dict[str, str]:
+        """
+        Runs every stage up to and including until
+
+        Returns:
+            Fingerprint of every stage that ran or was reused
+        """
+        fingerprints = {}
+        upstream = ''
+        upstream_ran = False
+        for name in STAGES[:STAGES.index(until) + 1]:
+            fingerprint = self._fingerprint(name, upstream)
+            if name == 'scan':
+                fingerprint = self._scan_baseline(fingerprint)
+            if not upstream_ran and name not in self.force and self._is_done(name, fingerprint):
+                logger.info(f"Stage {name} is up to date, skipping")
+            else:
+                # Once a stage ran, everything downstream is redone as well. A rescan with
+                # an unchanged listing produces the same index, so it does not count.
+                upstream_ran = name != 'scan'
+                logger.info(f"Running stage {name}")
+                start = time.time()
+                with stage(f'pipeline.{name}'):
+                    outputs = getattr(self, f'_run_{name}')(fingerprint)
+                self._mark_done(name, fingerprint, outputs)
+                logger.info(f"Stage {name} finished in {time.time() - start:.1f}s")
+            fingerprints[name] = fingerprint
+            upstream = fingerprint
+        return fingerprints
+
+    def _fingerprint(self, name: str, upstream: str) -> str:
+        """Hash of the stage config and the upstream fingerprint (the dataset listing for scan)"""
+        digest = hashlib.sha1(json.dumps(self.config[name], sort_keys=True).encode('utf-8'))
+        digest.update(upstream.encode('utf-8'))
+        if name == 'scan':
+            digest.update(self._listing_fingerprint().encode('utf-8'))
+        return digest.hexdigest()
+
+    def _scan_baseline(self, fingerprint: str) -> str:
+        """
+        Maps the listing left behind by the act stage to the scan it acted on
+
+        Moving or deleting outliers changes the listing; without this the next
+        run would rescan, re-extract and remove further images on every call.
+        """
+        manifest = self._read_manifest('scan')
+        if manifest and fingerprint == manifest.get('after_act') and 'scan' not in self.force:
+            return manifest['fingerprint']
+        return fingerprint
+
+    def _listing_fingerprint(self) -> str:
+        """Detects added, removed and modified images"""
+        self.loader = self._scan_loader()
+        digest = hashlib.sha1()
+        for path in self._paths():
+            try:
+                size, mtime_ns = image_stat(path)
+                digest.update(f"{path}|{size}|{mtime_ns}\n".encode('utf-8'))
+            except OSError:
+                digest.update(f"{path}|missing\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _manifest_path(self, name: str) -> Path:
+        return self.stage_dir / f"{name}.json"
+
+    def _read_manifest(self, name: str) -> Optional[Dict]:
+        path = self._manifest_path(name)
+        if not path.exists():
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _is_done(self, name: str, fingerprint: str) -> bool:
+        manifest = self._read_manifest(name)
+        if not manifest or manifest['fingerprint'] != fingerprint or manifest['status'] != 'done':
+            return False
+        return all((self.output_dir / output).exists() for output in manifest['outputs'])
+
+    def _mark_done(self, name: str, fingerprint: str, outputs: List[str]) -> None:
+        self._write_manifest(name, {'fingerprint': fingerprint, 'status': 'done',
+                                    'outputs': outputs, 'finished': time.time()})
+
+    def _write_manifest(self, name: str, manifest: Dict) -> None:
+        path = self._manifest_path(name)
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def _scan_loader(self) -> ImageLoader:
+        scan = self.config['scan']
+        loader_cls = ShardedImageLoader if scan['format'] == 'shards' else ImageLoader
+        return loader_cls(scan['root'], extensions=set(scan['extensions']), recursive=scan['recursive'])
+
+    def _paths(self) -> List[str]:
+        class_name = self.config['scan']['class_name']
+        if class_name:
+            return self.loader.get_images_by_class(class_name)
+        return self.loader.get_all_images()
+
+    def _run_scan(self, fingerprint: str) -> List[str]:
+        self.loader.save_index(str(self.output_dir / 'index.json'))
+        return ['index.json']
+
+    def _run_extract(self, fingerprint: str) -> List[str]:
+        settings = self.config['extract']
+        features_dir = self.output_dir / 'features'
+
+        # Resume an interrupted extraction of the same inputs, start over otherwise
+        manifest = self._read_manifest('extract')
+        if features_dir.exists() and (not manifest or manifest['fingerprint'] != fingerprint
+                                      or 'extract' in self.force):
+            shutil.rmtree(features_dir)
+        self._write_manifest('extract', {'fingerprint': fingerprint, 'status': 'running', 'outputs': []})
+
+        extractor = create_extractor(settings['extractor'], settings['options'])
+
+        # Scoring statistics are accumulated while extraction is still running
+        moments = RunningMoments()
+        job = PipelinedFeatureExtractionJob(
+            extractor,
+            ImageLoader.load_index(str(self.output_dir / 'index.json')),
+            str(features_dir),
+            batch_size=settings['batch_size'],
+            checkpoint_every=settings['checkpoint_every'],
+            class_name=self.config['scan']['class_name'],
+            decode_workers=settings['decode_workers'],
+            queue_size=settings['queue_size'],
+            on_batch=lambda start, rows: moments.update(rows)
+        )
+        job.run()
+        moments.save(str(features_dir / 'moments.npz'))
+        return ['features/features.npy', 'features/paths.json', 'features/moments.npz']
+
+    def _run_detect(self, fingerprint: str) -> List[str]:
+        from src.outliers.mahalanobis import mahalanobis
+        from src.outliers.ransacnn import RANSACNN
+
+        settings = self.config['detect']
+        result = FeatureExtractionJob.load(str(self.output_dir / 'features'))
+        features, paths = result['features'], result['paths']
+        valid = np.flatnonzero(np.isfinite(features).all(axis=1))
+        valid_features = np.asarray(features[valid])
+
+        np.random.seed(settings['seed'])
+        if settings['method'] == 'ransacnn':
+            detector = RANSACNN(valid_features)
+            detector.detect(sample_ratio=settings['sample_ratio'], threshold_iter=settings['threshold_iter'])
+        elif settings['method'] == 'mahalanobis':
+            moments = RunningMoments.load(str(self.output_dir / 'features' / 'moments.npz'))
+            detector = mahalanobis.from_features(valid_features, mean=moments.mean,
+                                                 covariance=moments.covariance())
+            detector.detect(threshold=settings['threshold'])
+        else:
+            raise ValueError(f"Unknown detection method: {settings['method']}")
+
+        scores = np.full(len(paths), np.nan)
+        scores[valid] = [detector.outlier_scores[i] for i in range(len(valid))]
+        np.save(self.output_dir / 'scores.npy', scores)
+
+        outliers = sorted(
+            ({'index': int(valid[i]), 'path': paths[valid[i]], 'score': float(detector.outlier_scores[i])}
+             for i in detector.outlier_indices),
+            key=lambda entry: entry['score'], reverse=True
+        )
+        with open(self.output_dir / 'outliers.json', 'w') as f:
+            json.dump({
+                'method': settings['method'],
+                'outliers': outliers,
+                'unreadable': [paths[i] for i in result['failed']]
+            }, f, indent=4)
+        logger.info(f"Detected {len(outliers)} outliers among {len(valid)} images")
+        return ['scores.npy', 'outliers.json']
+
+    @staticmethod
+    def _exists(path: str) -> bool:
+        try:
+            image_stat(path)
+            return True
+        except OSError:
+            return False
+
+    def _run_act(self, fingerprint: str) -> List[str]:
+        from src.utils.visualisation import DatasetVisualizer
+
+        settings = self.config['act']
+        with open(self.output_dir / 'outliers.json') as f:
+            # Images removed by an earlier act run on the same index are already gone
+            outlier_paths = [entry['path'] for entry in json.load(f)['outliers'] if self._exists(entry['path'])]
+
+        outputs = []
+        if settings['contact_sheet']:
+            DatasetVisualizer.save_contact_sheet({'outliers': outlier_paths},
+                                                 str(self.output_dir / settings['contact_sheet']),
+                                                 images_per_class=settings['images_per_row'],
+                                                 title="Detected Outliers")
+            outputs.append(settings['contact_sheet'])
+
+        if settings['action'] in ('move', 'delete') and outlier_paths:
+            loader = ImageLoader.load_index(str(self.output_dir / 'index.json'))
+            move_to = settings['move_to'] if settings['action'] == 'move' else None
+            if settings['action'] == 'move' and not move_to:
+                raise ValueError("act.move_to must be set for the 'move' action")
+            loader.remove_outliers(outlier_paths, move_to=move_to, confirm=settings['confirm'])
+
+            # The remaining listing is the result of this run, not a change of the dataset
+            scan_manifest = self._read_manifest('scan')
+            scan_manifest['after_act'] = self._fingerprint('scan', '')
+            self._write_manifest('scan', scan_manifest)
+        elif settings['action'] not in ('report', 'move', 'delete'):
+            raise ValueError(f"Unknown action: {settings['action']}")
+        return outputs
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Console entry point"""
+    parser = argparse.ArgumentParser(description="Scan a dataset, extract features, detect outliers and act on them")
+    parser.add_argument("config", nargs='?', help="JSON or TOML config file")
+    parser.add_argument("--force", nargs='+', choices=STAGES, default=[], help="Stages to redo even if up to date")
+    parser.add_argument("--until", choices=STAGES, default='act', help="Last stage to run")
+    parser.add_argument("--profile", help="Write a stage timing report to this JSON file")
+    parser.add_argument("--print-config", action='store_true', help="Print the default config and exit")
+    args = parser.parse_args(argv)
+
+    if args.print_config:
+        print(json.dumps(DEFAULT_CONFIG, indent=4))
+        return 0
+    if not args.config:
+        parser.error("a config file is required")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.profile:
+        instrumentation.enable()
+
+    Pipeline(load_config(args.config), force=args.force).run(until=args.until)
+
+    if args.profile:
+        instrumentation.save_report(args.profile)
+        logger.info(f"Profile written to {args.profile}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
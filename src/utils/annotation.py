@@ -7,13 +7,28 @@ import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
 from PIL import Image, ImageTk
-import speech_recognition as sr
 import json
 from src.utils.image_loader import ImageLoader
+from src.utils.prefetch import ImagePrefetcher
+from src.utils.shards import image_source
+from src.utils.annotation_journal import AnnotationJournal
+from src.utils.speech import SpeechBackend, SpeechWorker
 
 class Annotator:
-    def __init__(self, root=None):
-        """Initialize the Annotator with a tkinter root window"""
+    IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.gif'}
+    
+    def __init__(self, root=None, prefetch_radius: int = 3, cache_bytes: int = 256 * 1024 * 1024,
+                 speech_backend: SpeechBackend = None):
+        """
+        Initialize the Annotator with a tkinter root window
+        
+        Args:
+            root: Optional existing tkinter root
+            prefetch_radius: Number of images decoded ahead in each direction
+            cache_bytes: Memory budget of the decoded image cache
+            speech_backend: Speech recognizer backend, e.g. make_backend('vosk') for
+                offline dictation (defaults to the Google Web Speech API)
+        """
         if root is None:
             self.root = tk.Tk()
             self.root.title("Image Annotation Tool")
@@ -24,12 +39,20 @@ class Annotator:
         self.images = []
         self.image_paths = []
         self.annotations = {}
+        self.journal = None
         self.current_boxes = []
         self.drawing = False
         self.start_x = 0
         self.start_y = 0
+        self.prefetch_radius = prefetch_radius
+        self.prefetcher = ImagePrefetcher(max_bytes=cache_bytes)
+        self.display_size = None
+        self.speech_backend = speech_backend
+        self.speech_worker = None
+        self.speech_target = None
         
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
     def setup_ui(self):
         """Set up the user interface components"""
@@ -68,6 +91,18 @@ class Annotator:
                                     command=self.next_image, width=9)
         self.next_button.pack(side=tk.LEFT, padx=2)
         
+        # Jump to a position
+        self.jump_frame = tk.Frame(self.button_panel)
+        self.jump_frame.pack(pady=5)
+        
+        self.jump_var = tk.StringVar()
+        self.jump_entry = tk.Entry(self.jump_frame, textvariable=self.jump_var, width=10)
+        self.jump_entry.pack(side=tk.LEFT, padx=2)
+        self.jump_entry.bind("<Return>", self.on_jump)
+        
+        self.jump_button = tk.Button(self.jump_frame, text="Go", command=self.on_jump, width=7)
+        self.jump_button.pack(side=tk.LEFT, padx=2)
+        
         # Save annotations button
         self.save_button = tk.Button(self.button_panel, text="Save Annotations", 
                                     command=self.save_annotations, width=20)
@@ -107,21 +142,58 @@ class Annotator:
         folder_path = filedialog.askdirectory(title="Select Image Directory")
         if not folder_path:
             return
-            
-        self.image_paths = []
-        for file in os.listdir(folder_path):
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                self.image_paths.append(os.path.join(folder_path, file))
         
-        if not self.image_paths:
+        loader = ImageLoader(folder_path, extensions=self.IMAGE_EXTENSIONS)
+        self.open_loader(loader)
+    
+    def open_loader(self, loader: ImageLoader, class_names=None, paths=None, annotations_dir=None):
+        """
+        Review the images of an ImageLoader, optionally filtered
+        
+        Args:
+            loader: ImageLoader (or one restored with ImageLoader.load_index)
+            class_names: Only review images of these classes
+            paths: Only review these paths, e.g. the outliers found by a detector
+            annotations_dir: Directory of the autosave journal (defaults to <root>/.annotations)
+        """
+        image_paths = loader.view(class_names=class_names, paths=paths)
+        if not image_paths:
+            # Keep the current session, so navigation still matches the image on the canvas
             messagebox.showinfo("Info", "No images found in the selected directory")
             return
             
+        self.update_annotations()
+        self.image_paths = image_paths
         self.current_image_index = 0
-        self.annotations = {}
+        self.open_journal(annotations_dir or os.path.join(loader.root_path, ".annotations"))
+        self.display_size = None
+        self.prefetcher.clear()
         self.display_current_image()
         self.status_var.set(f"Loaded {len(self.image_paths)} images")
     
+    def open_index(self, index_path, class_names=None, paths=None):
+        """Review a dataset from an index written by ImageLoader.save_index"""
+        self.open_loader(ImageLoader.load_index(index_path), class_names=class_names, paths=paths)
+    
+    def jump_to(self, index):
+        """Display the image at a given position"""
+        if not self.image_paths:
+            return
+        if not 0 <= index < len(self.image_paths):
+            messagebox.showinfo("Info", f"Index must be between 1 and {len(self.image_paths)}")
+            return
+        self.update_annotations()
+        self.current_image_index = index
+        self.display_current_image()
+    
+    def on_jump(self, event=None):
+        """Handle the Go button of the jump field (1-based positions)"""
+        try:
+            index = int(self.jump_var.get()) - 1
+        except ValueError:
+            return
+        self.jump_to(index)
+    
     def display_current_image(self):
         """Display the current image on the canvas"""
         if not self.image_paths or self.current_image_index >= len(self.image_paths):
@@ -133,18 +205,19 @@ class Annotator:
         
         # Load and display image
         img_path = self.image_paths[self.current_image_index]
-        img = Image.open(img_path)
         
         # Resize image to fit canvas while maintaining aspect ratio
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
         
         if canvas_width > 1 and canvas_height > 1:  # Ensure canvas has been drawn
-            img_width, img_height = img.size
-            ratio = min(canvas_width/img_width, canvas_height/img_height)
-            new_width = int(img_width * ratio)
-            new_height = int(img_height * ratio)
-            img = img.resize((new_width, new_height), Image.LANCZOS)
+            # The display size is fixed on first draw, as the canvas is then resized to the image
+            if self.display_size is None:
+                self.display_size = (canvas_width, canvas_height)
+            img = self.prefetcher.get(img_path, self.display_size)
+            self.prefetch_neighbours()
+        else:
+            img = Image.open(image_source(img_path))
         
         self.tk_image = ImageTk.PhotoImage(img)
         self.canvas.config(width=self.tk_image.width(), height=self.tk_image.height())
@@ -152,15 +225,15 @@ class Annotator:
         
         # Display existing annotations if any
         img_name = os.path.basename(img_path)
-        if img_name in self.annotations:
+        if img_path in self.annotations:
             # Display bounding boxes
-            for box in self.annotations[img_name].get('boxes', []):
+            for box in self.annotations[img_path].get('boxes', []):
                 x1, y1, x2, y2 = box
                 self.canvas.create_rectangle(x1, y1, x2, y2, outline="red", width=2)
                 self.current_boxes.append((x1, y1, x2, y2))
             
             # Display text annotation
-            text = self.annotations[img_name].get('text', '')
+            text = self.annotations[img_path].get('text', '')
             self.annotation_text.delete(1.0, tk.END)
             self.annotation_text.insert(tk.END, text)
         else:
@@ -168,6 +241,14 @@ class Annotator:
         
         self.status_var.set(f"Image {self.current_image_index + 1}/{len(self.image_paths)}: {img_name}")
     
+    def prefetch_neighbours(self):
+        """Decode the next and previous images in the background, nearest first"""
+        indices = []
+        for offset in range(1, self.prefetch_radius + 1):
+            indices.extend([self.current_image_index + offset, self.current_image_index - offset])
+        paths = [self.image_paths[i] for i in indices if 0 <= i < len(self.image_paths)]
+        self.prefetcher.prefetch(paths, self.display_size)
+    
     def toggle_drawing(self):
         """Toggle drawing mode"""
         self.drawing = not self.drawing
@@ -221,50 +302,94 @@ class Annotator:
         self.update_annotations()
     
     def speech_to_text(self):
-        """Record speech and convert to text annotation"""
-        self.status_var.set("Listening... Speak now")
-        self.root.update()
-        
-        recognizer = sr.Recognizer()
-        with sr.Microphone() as source:
-            try:
-                recognizer.adjust_for_ambient_noise(source)
-                audio = recognizer.listen(source, timeout=5)
-                text = recognizer.recognize_google(audio)
-                
-                # Add to current text
-                current_text = self.annotation_text.get(1.0, tk.END).strip()
-                if current_text:
-                    new_text = current_text + " " + text
-                else:
-                    new_text = text
-                
-                self.annotation_text.delete(1.0, tk.END)
-                self.annotation_text.insert(tk.END, new_text)
-                
-                # Update annotations
-                self.update_annotations()
+        """Record speech in the background and append the transcription to the text annotation"""
+        if not self.image_paths:
+            return
+        if self.speech_worker is None:
+            self.speech_worker = SpeechWorker(self.speech_backend)
+        if not self.speech_worker.request():
+            self.status_var.set("Already listening...")
+            return
+        
+        # Remember which image the dictation belongs to, the user may navigate meanwhile
+        self.speech_target = self.image_paths[self.current_image_index]
+        self.speech_button.config(state=tk.DISABLED)
+        self.root.after(100, self.poll_speech)
+    
+    def poll_speech(self):
+        """Apply results of the speech worker on the UI thread"""
+        finished = False
+        while not self.speech_worker.results.empty():
+            kind, message = self.speech_worker.results.get_nowait()
+            if kind == 'status':
+                self.status_var.set(message)
+            elif kind == 'text':
+                self.append_text(self.speech_target, message)
                 self.status_var.set("Speech recognized")
-            except sr.WaitTimeoutError:
-                self.status_var.set("No speech detected")
-            except sr.UnknownValueError:
-                self.status_var.set("Could not understand audio")
-            except sr.RequestError:
-                self.status_var.set("Could not request results; check your network connection")
+                finished = True
+            else:
+                self.status_var.set(message)
+                finished = True
+        
+        if finished:
+            self.speech_button.config(state=tk.NORMAL)
+        else:
+            self.root.after(100, self.poll_speech)
+    
+    def append_text(self, img_path, text):
+        """Append text to the annotation of an image"""
+        if img_path == self.image_paths[self.current_image_index]:
+            # Add to current text
+            current_text = self.annotation_text.get(1.0, tk.END).strip()
+            if current_text:
+                new_text = current_text + " " + text
+            else:
+                new_text = text
+            
+            self.annotation_text.delete(1.0, tk.END)
+            self.annotation_text.insert(tk.END, new_text)
+            
+            # Update annotations
+            self.update_annotations()
+            return
+        
+        annotation = dict(self.annotations.get(img_path, {'boxes': [], 'text': '', 'path': img_path}))
+        annotation['text'] = (annotation['text'] + " " + text).strip()
+        self.annotations[img_path] = annotation
+        if self.journal is not None:
+            self.journal.record(img_path, annotation)
     
     def update_annotations(self):
         """Update the annotations dictionary with current data"""
         if not self.image_paths:
             return
             
-        img_name = os.path.basename(self.image_paths[self.current_image_index])
+        img_path = self.image_paths[self.current_image_index]
         text = self.annotation_text.get(1.0, tk.END).strip()
         
-        self.annotations[img_name] = {
-            'boxes': self.current_boxes,
+        # Keyed by full path so files sharing a name in different folders stay apart
+        annotation = {
+            'boxes': [list(box) for box in self.current_boxes],
             'text': text,
-            'path': self.image_paths[self.current_image_index]
+            'path': img_path
         }
+        previous = self.annotations.get(img_path)
+        if previous == annotation:
+            return
+        # Browsing past an image without annotating it must not journal an empty entry
+        if previous is None and not annotation['boxes'] and not text:
+            return
+        self.annotations[img_path] = annotation
+        if self.journal is not None:
+            self.journal.record(img_path, annotation)
+    
+    def open_journal(self, directory):
+        """Switch to the autosave journal in directory and restore its annotations"""
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = AnnotationJournal(directory)
+        # The journal replayed its files on open; copy that state rather than parsing them again
+        self.annotations = dict(self.journal.state)
     
     def next_image(self):
         """Navigate to the next image"""
@@ -314,18 +439,40 @@ class Annotator:
         try:
             with open(file_path, 'w') as f:
                 json.dump(self.annotations, f, indent=4)
+            if self.journal is not None:
+                self.journal.compact()
             self.status_var.set(f"Annotations saved to {file_path}")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save annotations: {str(e)}")
     
+    def on_close(self):
+        """Persist pending annotations, stop background workers and close the window"""
+        self.update_annotations()
+        if self.journal is not None:
+            self.journal.close()
+        self.prefetcher.close()
+        if self.speech_worker is not None:
+            self.speech_worker.close()
+        self.root.destroy()
+    
     def run(self):
         """Run the application main loop"""
         self.root.mainloop()
 
 
-def launch_annotator():
-    """Launch the annotator as a standalone application"""
+def launch_annotator(loader: ImageLoader = None, class_names=None, paths=None):
+    """
+    Launch the annotator as a standalone application
+    
+    Args:
+        loader: Optional ImageLoader opened right away
+        class_names: Only review images of these classes
+        paths: Only review these paths, e.g. a detector's top-k outliers
+    """
     annotator = Annotator()
+    if loader is not None:
+        # Wait for the window to be drawn so the first image is fitted to the canvas
+        annotator.root.after(100, lambda: annotator.open_loader(loader, class_names=class_names, paths=paths))
     annotator.run()
 
 
@@ -0,0 +1,168 @@
+"""
+Append-only annotation journal with periodic snapshot compaction
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AnnotationJournal:
+    SNAPSHOT_FILE = "annotations.snapshot.json"
+    JOURNAL_FILE = "annotations.journal.jsonl"
+
+    def __init__(self, directory: str, compact_every: int = 5000, sync_interval: float = 1.0):
+        """
+        Persists annotations keyed by full image path as they change
+
+        Every change is appended as one JSON line by a background writer. After
+        compact_every records the writer folds the journal into a snapshot file,
+        so resuming only parses one JSON document and a short journal.
+
+        Args:
+            directory: Directory holding the snapshot and journal files
+            compact_every: Number of journal records between two compactions
+            sync_interval: Maximum time in seconds before records are fsynced
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.snapshot_path = self.directory / self.SNAPSHOT_FILE
+        self.journal_path = self.directory / self.JOURNAL_FILE
+        self.compact_every = compact_every
+        self.sync_interval = sync_interval
+
+        self.state: Dict[str, dict] = {}
+        self.records_since_compaction = 0
+        self.queue: "queue.Queue" = queue.Queue()
+        self.closed = False
+        self.load()
+
+        self.journal_file = open(self.journal_path, 'a', encoding='utf-8')
+        if self.journal_file.tell() > 0 and not self._ends_with_newline():
+            # Terminate a line left half-written by a crash so the next record stays parseable
+            self.journal_file.write("\n")
+        self.writer = threading.Thread(target=self._write_loop, name="annotation-journal", daemon=True)
+        self.writer.start()
+
+    def load(self) -> Dict[str, dict]:
+        """Rebuilds the annotations from the snapshot followed by the journal"""
+        state = {}
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                state = json.load(f)['annotations']
+
+        records = 0
+        if self.journal_path.exists():
+            with open(self.journal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash can leave a truncated last line behind
+                        logger.warning(f"Skipping corrupt journal line in {self.journal_path}")
+                        continue
+                    if record['annotation'] is None:
+                        state.pop(record['path'], None)
+                    else:
+                        state[record['path']] = record['annotation']
+                    records += 1
+
+        self.state = state
+        self.records_since_compaction = records
+        return dict(state)
+
+    def record(self, path: str, annotation: Optional[dict]) -> None:
+        """Queues a change for an image; None removes its annotation"""
+        if self.closed:
+            raise RuntimeError("Journal is closed")
+        self.queue.put(('record', path, annotation))
+
+    def compact(self) -> None:
+        """Asks the writer to fold the journal into a new snapshot"""
+        self.queue.put(('compact', None, None))
+
+    def flush(self) -> None:
+        """Blocks until every queued change is on disk"""
+        self.queue.join()
+
+    def close(self) -> None:
+        """Writes pending changes, compacts and stops the writer"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(('compact', None, None))
+        self.queue.put(('stop', None, None))
+        self.writer.join()
+        self.journal_file.close()
+
+    def _write_loop(self) -> None:
+        last_sync = time.monotonic()
+        dirty = False
+        while True:
+            try:
+                op, path, annotation = self.queue.get(timeout=self.sync_interval)
+            except queue.Empty:
+                if dirty:
+                    self._sync()
+                    dirty = False
+                    last_sync = time.monotonic()
+                continue
+
+            try:
+                if op == 'record':
+                    self.journal_file.write(json.dumps({'path': path, 'annotation': annotation}) + "\n")
+                    if annotation is None:
+                        self.state.pop(path, None)
+                    else:
+                        self.state[path] = annotation
+                    self.records_since_compaction += 1
+                    dirty = True
+                    if self.records_since_compaction >= self.compact_every:
+                        self._compact()
+                        dirty = False
+                elif op == 'compact':
+                    self._compact()
+                    dirty = False
+                elif op == 'stop':
+                    return
+
+                # Sync once the queue drains, or periodically under a steady stream of changes
+                if dirty and (self.queue.empty() or time.monotonic() - last_sync >= self.sync_interval):
+                    self._sync()
+                    dirty = False
+                    last_sync = time.monotonic()
+            except Exception as e:
+                logger.error(f"Failed to write annotation journal: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.journal_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _sync(self) -> None:
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+
+    def _compact(self) -> None:
+        """Atomically replaces the snapshot, then truncates the journal it now contains"""
+        self._sync()
+        tmp_path = self.snapshot_path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'annotations': self.state}, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Replaying a journal already folded into the snapshot is harmless,
+        # so a crash between these two steps loses nothing
+        self.journal_file.seek(0)
+        self.journal_file.truncate()
+        self.records_since_compaction = 0
@@ -0,0 +1,258 @@
+"""
+2D projections of feature vectors rendered by density binning,
+so millions of points can be inspected at once
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.patches import Patch
+
+from src.utils.image_loader import class_of
+
+
+class EmbeddingProjector:
+    def __init__(
+        self,
+        method: str = 'pca',
+        n_components: int = 2,
+        fit_sample: int = 100_000,
+        chunk_size: int = 100_000,
+        random_state: int = 0
+    ):
+        """
+        Reduces feature vectors to a few dimensions for plotting
+
+        The projection is fitted on a random subset of rows and then applied in
+        chunks, so memmapped matrices larger than RAM can be projected.
+
+        Args:
+            method: 'pca' for randomized PCA or 'random' for a Gaussian random projection
+            n_components: Number of output dimensions
+            fit_sample: Maximum number of rows used to fit the projection
+            chunk_size: Number of rows transformed at once
+            random_state: Seed making the projection reproducible
+        """
+        if method not in ('pca', 'random'):
+            raise ValueError(f"Unknown projection method: {method}")
+        self.method = method
+        self.n_components = n_components
+        self.fit_sample = fit_sample
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+        self.model = None
+
+    def fit(self, features: np.ndarray) -> 'EmbeddingProjector':
+        """Fits the projection on (a sample of) the features"""
+        rng = np.random.default_rng(self.random_state)
+        if len(features) > self.fit_sample:
+            idx = np.sort(rng.choice(len(features), size=self.fit_sample, replace=False))
+            sample = np.asarray(features[idx], dtype=np.float32)
+        else:
+            sample = np.asarray(features, dtype=np.float32)
+        sample = sample[np.isfinite(sample).all(axis=1)]
+
+        if self.method == 'pca':
+            from sklearn.decomposition import PCA
+            self.model = PCA(n_components=self.n_components, svd_solver='randomized',
+                             random_state=self.random_state)
+        else:
+            from sklearn.random_projection import GaussianRandomProjection
+            self.model = GaussianRandomProjection(n_components=self.n_components,
+                                                  random_state=self.random_state)
+        self.model.fit(sample)
+        return self
+
+    def transform(self, features: np.ndarray) -> np.ndarray:
+        """
+        Projects all features chunk by chunk into a float32 array
+
+        Rows with non-finite values (unreadable images) get NaN coordinates.
+        """
+        if self.model is None:
+            raise RuntimeError("Projection must be fitted before transform")
+        coords = np.full((len(features), self.n_components), np.nan, dtype=np.float32)
+        for start in range(0, len(features), self.chunk_size):
+            chunk = np.asarray(features[start:start + self.chunk_size], dtype=np.float32)
+            finite = np.flatnonzero(np.isfinite(chunk).all(axis=1))
+            if len(finite):
+                coords[start + finite] = self.model.transform(chunk[finite])
+        return coords
+
+    def fit_transform(self, features: np.ndarray) -> np.ndarray:
+        return self.fit(features).transform(features)
+
+
+class EmbeddingVisualizer:
+    @staticmethod
+    def labels_from_paths(image_paths: Sequence[str]) -> List[str]:
+        """Class names of image paths, following the ImageLoader folder convention"""
+        return [class_of(path) for path in image_paths]
+
+    @staticmethod
+    def rasterize(
+        coords: np.ndarray,
+        labels: Optional[Sequence] = None,
+        scores: Optional[np.ndarray] = None,
+        bins: int = 512,
+        cmap: str = 'viridis'
+    ) -> Dict:
+        """
+        Bins 2D points into an RGBA image instead of drawing one artist per point
+
+        Pixel colour is the mean outlier score of the bin when scores are given,
+        otherwise the count-weighted mix of class colours; opacity follows the
+        log point density.
+
+        Args:
+            coords: Array of shape (n, 2)
+            labels: Optional class label of every point
+            scores: Optional outlier score of every point
+            bins: Resolution of the raster along each axis
+            cmap: Matplotlib colormap used for scores
+
+        Returns:
+            Dictionary with the RGBA 'image', its 'extent' and the 'class_colors' used
+        """
+        coords = np.asarray(coords, dtype=np.float32)
+        finite = np.isfinite(coords).all(axis=1)
+        x, y = coords[finite, 0], coords[finite, 1]
+        x_min, x_max = float(x.min()), float(x.max())
+        y_min, y_max = float(y.min()), float(y.max())
+        x_span = (x_max - x_min) or 1.0
+        y_span = (y_max - y_min) or 1.0
+
+        # One flat bin index per point lets every aggregate be a single bincount
+        ix = np.minimum(((x - x_min) / x_span * bins).astype(np.int64), bins - 1)
+        iy = np.minimum(((y - y_min) / y_span * bins).astype(np.int64), bins - 1)
+        flat = iy * bins + ix
+        density = np.bincount(flat, minlength=bins * bins).astype(np.float64)
+        occupied = density > 0
+
+        rgb = np.ones((bins * bins, 3))
+        class_colors = {}
+        if scores is not None:
+            scores = np.asarray(scores, dtype=np.float64)[finite]
+            scores = np.where(np.isfinite(scores), scores, np.nanmin(scores))
+            mean_score = np.zeros(bins * bins)
+            mean_score[occupied] = np.bincount(flat, weights=scores, minlength=bins * bins)[occupied] / density[occupied]
+            low, high = np.nanmin(scores), np.nanmax(scores)
+            normalized = (mean_score - low) / ((high - low) or 1.0)
+            rgb = plt.get_cmap(cmap)(normalized)[:, :3]
+        elif labels is not None:
+            labels = np.asarray(labels)[finite]
+            classes, codes = np.unique(labels, return_inverse=True)
+            palette = plt.get_cmap('tab20' if len(classes) > 10 else 'tab10')
+            colors = np.array([palette(i % palette.N)[:3] for i in range(len(classes))])
+            class_colors = {str(name): tuple(colors[i]) for i, name in enumerate(classes)}
+            for channel in range(3):
+                summed = np.bincount(flat, weights=colors[codes, channel], minlength=bins * bins)
+                rgb[occupied, channel] = summed[occupied] / density[occupied]
+        else:
+            rgb[:] = (0.12, 0.29, 0.55)
+
+        alpha = np.log1p(density) / np.log1p(density.max())
+        image = np.concatenate([rgb, alpha[:, None]], axis=1).reshape(bins, bins, 4)
+        return {
+            'image': image,
+            'extent': (x_min, x_max, y_min, y_max),
+            'class_colors': class_colors
+        }
+
+    @staticmethod
+    def plot(
+        coords: np.ndarray,
+        labels: Optional[Sequence] = None,
+        scores: Optional[np.ndarray] = None,
+        outlier_indices: Optional[Sequence[int]] = None,
+        bins: int = 512,
+        title: str = "Embedding Overview",
+        output_path: Optional[str] = None
+    ):
+        """
+        Draws a density raster of projected features with outliers highlighted on top
+
+        Args:
+            coords: Projected features of shape (n, 2)
+            labels: Optional class label of every point
+            scores: Optional outlier score of every point (takes precedence over labels for colouring)
+            outlier_indices: Optional indices drawn as individual highlighted markers
+            bins: Resolution of the raster along each axis
+            title: Title of the figure
+            output_path: Optional image file to save to instead of opening a window
+        """
+        raster = EmbeddingVisualizer.rasterize(coords, labels=labels, scores=scores, bins=bins)
+
+        fig, ax = plt.subplots(figsize=(10, 10))
+        ax.imshow(raster['image'], extent=raster['extent'], origin='lower',
+                  aspect='auto', interpolation='nearest')
+
+        handles = []
+        if scores is not None:
+            scores = np.asarray(scores, dtype=np.float64)
+            mappable = plt.cm.ScalarMappable(cmap='viridis',
+                                             norm=plt.Normalize(np.nanmin(scores), np.nanmax(scores)))
+            fig.colorbar(mappable, ax=ax, fraction=0.046, pad=0.04, label='Outlier score')
+        elif raster['class_colors']:
+            handles = [Patch(color=color, label=name)
+                       for name, color in list(raster['class_colors'].items())[:20]]
+
+        if outlier_indices is not None and len(outlier_indices):
+            points = np.asarray(coords)[np.asarray(outlier_indices, dtype=np.int64)]
+            ax.scatter(points[:, 0], points[:, 1], s=30, facecolors='none',
+                       edgecolors='red', linewidths=1.2, rasterized=True)
+            handles.append(plt.Line2D([], [], marker='o', linestyle='', markerfacecolor='none',
+                                      markeredgecolor='red', label=f'Outliers ({len(outlier_indices)})'))
+
+        if handles:
+            ax.legend(handles=handles, loc='best', fontsize='small')
+        ax.set_title(title)
+        ax.set_xticks([])
+        ax.set_yticks([])
+
+        if output_path:
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+            fig.savefig(output_path, dpi=150, bbox_inches='tight')
+            plt.close(fig)
+        else:
+            plt.show()
+
+    @staticmethod
+    def viz_detector(
+        detector,
+        image_paths: Optional[Sequence[str]] = None,
+        method: str = 'pca',
+        color_by: str = 'score',
+        bins: int = 512,
+        output_path: Optional[str] = None
+    ) -> np.ndarray:
+        """
+        Projects the features of a fitted outlier detector (mahalanobis, RANSACNN) and plots them
+
+        Args:
+            detector: Outlier instance on which detect() has been called
+            image_paths: Paths aligned with the detector features, used for class colouring
+            method: Projection method passed to EmbeddingProjector
+            color_by: 'score' or 'class'
+            bins: Resolution of the raster along each axis
+            output_path: Optional image file to save to instead of opening a window
+
+        Returns:
+            The 2D coordinates, so later plots can reuse them
+        """
+        coords = EmbeddingProjector(method=method).fit_transform(detector.features)
+        scores = None
+        labels = None
+        if color_by == 'score' and detector.outlier_scores:
+            # Detectors score every row, keyed 0..n-1 in row order
+            scores = np.fromiter(detector.outlier_scores.values(), dtype=np.float64,
+                                 count=len(detector.outlier_scores))
+        elif image_paths is not None:
+            labels = EmbeddingVisualizer.labels_from_paths(image_paths)
+
+        EmbeddingVisualizer.plot(coords, labels=labels, scores=scores,
+                                 outlier_indices=detector.outlier_indices,
+                                 bins=bins, output_path=output_path)
+        return coords
@@ -6,7 +6,8 @@ from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
 
 import numpy as np
 
-from PIL import Image
+from src.utils.image_io import open_image
+from src.utils.profiling import stage
 
 class FeatureExtractor:
     def __init__(self, input_shape=(224, 224)):
@@ -16,18 +17,29 @@ class FeatureExtractor:
             weights='imagenet',
             pooling='avg'
         )
+
+    @property
+    def feature_dim(self):
+        """Length of the feature vectors returned by the model"""
+        return self.model.output_shape[-1]
     
+    def load_image(self, image_path):
+        """Load an image and convert it to a preprocessed model input array"""
+        img = open_image(image_path)
+        img = img.resize(self.input_shape)
+        img_array = tf.keras.preprocessing.image.img_to_array(img)
+        return preprocess_input(img_array)
+
     def extract_features(self, image_path):
         """Extract normalized features from a single image"""
         # Load and preprocess image
-        img = Image.open(image_path).convert('RGB')
-        img = img.resize(self.input_shape)
-        img_array = tf.keras.preprocessing.image.img_to_array(img)
-        img_array = preprocess_input(img_array)
+        with stage('feature_extractor.decode', items=1):
+            img_array = self.load_image(image_path)
         img_array = np.expand_dims(img_array, axis=0)
         
         # Extract features
-        features = self.model.predict(img_array)
+        with stage('feature_extractor.inference', items=1):
+            features = self.model.predict(img_array)
         
         # Normalize features
         normalized_features = features / np.linalg.norm(features)
@@ -39,3 +51,48 @@ class FeatureExtractor:
         for path in image_paths:
             features.append(self.extract_features(path))
         return np.array(features)
+
+    def extract_batch(self, image_paths):
+        """
+        Extract normalized features from several images with a single model call
+        
+        Args:
+            image_paths: Paths of the images to process together
+            
+        Returns:
+            Array of shape (len(image_paths), feature_dim)
+        """
+        # Timed once per batch, so profiling a large run does not add a record per image
+        with stage('feature_extractor.decode', items=len(image_paths)):
+            batch = np.stack([self.load_image(path) for path in image_paths])
+        return self.predict(batch)
+
+    def predict(self, batch):
+        """
+        Run the model on a batch of arrays returned by load_image
+        
+        Returns:
+            L2-normalized features of shape (len(batch), feature_dim)
+        """
+        with stage('feature_extractor.inference', items=len(batch)):
+            features = self.model.predict(batch, verbose=0)
+        return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+    def batch_extract_to_disk(self, image_loader, output_dir, batch_size=32, class_name=None):
+        """
+        Resumable variant of batch_extract streaming features into a memmap on disk
+        
+        Args:
+            image_loader: ImageLoader whose index defines the row order
+            output_dir: Directory holding the feature matrix and its checkpoint
+            batch_size: Number of images passed to the model at once
+            class_name: Optional class to restrict extraction to
+            
+        Returns:
+            Memory-mapped feature matrix aligned with the ImageLoader index
+        """
+        from src.utils.feature_job import FeatureExtractionJob
+        
+        job = FeatureExtractionJob(self, image_loader, output_dir,
+                                   batch_size=batch_size, class_name=class_name)
+        return job.run()
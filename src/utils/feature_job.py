@@ -0,0 +1,467 @@
+"""
+Resumable feature extraction jobs that stream features
+into a memory-mapped matrix aligned with the ImageLoader index
+"""
+
+import hashlib
+import importlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from src.utils.image_loader import ImageLoader
+from src.utils.profiling import stage
+
+logger = logging.getLogger(__name__)
+
+
+def create_extractor(spec: str, options: Optional[Dict] = None):
+    """
+    Instantiates a feature extractor from a 'module:Class' string
+
+    Args:
+        spec: Import path such as 'src.utils.feature_extractor:FeatureExtractor'
+        options: Keyword arguments passed to the constructor
+    """
+    module_name, class_name = spec.split(':')
+    extractor_cls = getattr(importlib.import_module(module_name), class_name)
+    return extractor_cls(**(options or {}))
+
+
+class FeatureExtractionJob:
+    FEATURES_FILE = "features.npy"
+    PATHS_FILE = "paths.json"
+    CHECKPOINT_FILE = "checkpoint.json"
+
+    def __init__(
+        self,
+        extractor,
+        image_loader: ImageLoader,
+        output_dir: str,
+        batch_size: int = 32,
+        checkpoint_every: int = 10,
+        class_name: Optional[str] = None,
+        image_paths: Optional[List[str]] = None
+    ):
+        """
+        Streams features from an extractor into a preallocated float32 memmap
+
+        Row i of the matrix holds the features of the i-th path of the
+        ImageLoader index, so a restarted job skips every row that was
+        already checkpointed.
+
+        Args:
+            extractor: FeatureExtractor (anything with extract_batch or extract_features)
+            image_loader: ImageLoader whose index defines the row order
+            output_dir: Directory holding the matrix, path list and checkpoint
+            batch_size: Number of images passed to the model at once
+            checkpoint_every: Number of batches between two checkpoints
+            class_name: Optional class to restrict the job to
+            image_paths: Explicit paths to process instead of the loader index
+                (image_loader may then be None), e.g. one shard of it
+        """
+        self.extractor = extractor
+        self.output_dir = Path(output_dir)
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every
+
+        if image_paths is not None:
+            self.image_paths = list(image_paths)
+        elif class_name:
+            self.image_paths = image_loader.get_images_by_class(class_name)
+        else:
+            self.image_paths = image_loader.get_all_images()
+
+        self.fingerprint = hashlib.sha1("\n".join(self.image_paths).encode("utf-8")).hexdigest()
+        self.completed = 0
+        self.failed: List[int] = []
+        self.features = None
+
+    @property
+    def features_path(self) -> Path:
+        return self.output_dir / self.FEATURES_FILE
+
+    @property
+    def checkpoint_path(self) -> Path:
+        return self.output_dir / self.CHECKPOINT_FILE
+
+    def run(self) -> np.memmap:
+        """
+        Runs (or resumes) the job until every row of the matrix is filled
+
+        Returns:
+            Memory-mapped feature matrix of shape (num_images, feature_dim).
+            Rows of images that could not be read are filled with NaN.
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        total = len(self.image_paths)
+        if total == 0:
+            raise ValueError("No images to extract features from")
+
+        self._resume()
+        if self.completed:
+            logger.info(f"Resuming feature extraction at row {self.completed}/{total}")
+
+        start_time = time.time()
+        start_row = self.completed
+        batches_since_checkpoint = 0
+
+        while self.completed < total:
+            end = min(self.completed + self.batch_size, total)
+            self._store(self.completed, end - self.completed, self._extract(self.completed, end))
+            self.completed = end
+            if self.completed == total and self.features is None:
+                self._allocate_unreadable()
+
+            batches_since_checkpoint += 1
+            if self.features is not None and (batches_since_checkpoint >= self.checkpoint_every
+                                              or self.completed == total):
+                self._checkpoint()
+                batches_since_checkpoint = 0
+
+                elapsed = time.time() - start_time
+                rate = (self.completed - start_row) / elapsed if elapsed > 0 else 0.0
+                eta = (total - self.completed) / rate if rate > 0 else float("inf")
+                logger.info(
+                    f"Extracted {self.completed}/{total} images "
+                    f"({rate:.1f} img/s, ETA {eta:.0f}s)"
+                )
+
+        if self.failed:
+            logger.warning(f"{len(self.failed)} images could not be processed")
+        return self.features
+
+    def get_progress(self) -> Dict:
+        """Returns the checkpointed progress of the job"""
+        return {
+            'completed': self.completed,
+            'total': len(self.image_paths),
+            'failed': len(self.failed)
+        }
+
+    @classmethod
+    def load(cls, output_dir: str) -> Dict:
+        """
+        Opens the results of a (possibly unfinished) job read-only
+
+        Returns:
+            Dictionary with the feature memmap, the aligned paths and the progress
+        """
+        output_dir = Path(output_dir)
+        with open(output_dir / cls.CHECKPOINT_FILE) as f:
+            checkpoint = json.load(f)
+        with open(output_dir / cls.PATHS_FILE) as f:
+            paths = json.load(f)
+        features = np.load(output_dir / cls.FEATURES_FILE, mmap_mode='r')
+        return {
+            'features': features,
+            'paths': paths,
+            'completed': checkpoint['completed'],
+            'failed': checkpoint['failed']
+        }
+
+    def _extract(self, start: int, end: int) -> Optional[np.ndarray]:
+        """
+        Extracts one batch, falling back to single images when a batch fails
+
+        Returns None when no image of the batch could be read and the feature
+        dimension is not known yet.
+        """
+        paths = self.image_paths[start:end]
+        if hasattr(self.extractor, 'extract_batch'):
+            try:
+                return np.asarray(self.extractor.extract_batch(paths), dtype=np.float32)
+            except Exception as e:
+                logger.debug(f"Batch {start}-{end} failed ({e}), retrying image by image")
+
+        rows = []
+        for offset, path in enumerate(paths):
+            try:
+                rows.append(np.asarray(self.extractor.extract_features(path), dtype=np.float32))
+            except Exception as e:
+                logger.warning(f"Failed to extract features from {path}: {e}")
+                self.failed.append(start + offset)
+                rows.append(None)
+
+        dim = self.features.shape[1] if self.features is not None else None
+        if dim is None:
+            valid = [row for row in rows if row is not None]
+            if not valid:
+                return None
+            dim = valid[0].shape[0]
+        return np.stack([
+            row if row is not None else np.full(dim, np.nan, dtype=np.float32)
+            for row in rows
+        ])
+
+    def _store(self, start: int, count: int, rows: Optional[np.ndarray]) -> None:
+        """
+        Writes a batch of rows, allocating the matrix once the feature dimension is known
+
+        rows is None for a batch without any readable image; before the matrix
+        exists such rows are only recorded as failed and filled with NaN on allocation.
+        """
+        if rows is None:
+            if self.features is None:
+                return
+            rows = np.full((count, self.features.shape[1]), np.nan, dtype=np.float32)
+        if self.features is None:
+            self._allocate(rows.shape[1])
+            # Every row before the first readable image failed
+            self.features[:start] = np.nan
+        self.features[start:start + count] = rows
+
+    def _allocate_unreadable(self) -> None:
+        """Allocates an all-NaN matrix when no image at all could be read"""
+        dim = getattr(self.extractor, 'feature_dim', None)
+        if dim is None:
+            raise RuntimeError(
+                f"None of the {len(self.image_paths)} images could be read and the extractor "
+                "does not report its feature_dim"
+            )
+        self._allocate(dim)
+        self.features[:] = np.nan
+
+    def _allocate(self, dim: int) -> None:
+        """Preallocates the feature matrix and records the row order"""
+        self.features = np.lib.format.open_memmap(
+            self.features_path, mode='w+', dtype=np.float32,
+            shape=(len(self.image_paths), dim)
+        )
+        self._atomic_write(self.output_dir / self.PATHS_FILE, self.image_paths)
+
+    def _resume(self) -> None:
+        """Restores progress from an existing checkpoint"""
+        if not self.checkpoint_path.exists() or not self.features_path.exists():
+            return
+
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('fingerprint') != self.fingerprint:
+            raise ValueError(
+                f"{self.output_dir} holds a job for a different image index; "
+                "use another output directory"
+            )
+
+        self.features = np.load(self.features_path, mmap_mode='r+')
+        self.completed = checkpoint['completed']
+        self.failed = checkpoint['failed']
+
+    def _checkpoint(self) -> None:
+        """Flushes the matrix to disk, then atomically records the progress"""
+        self.features.flush()
+        self._atomic_write(self.checkpoint_path, {
+            'fingerprint': self.fingerprint,
+            'completed': self.completed,
+            'failed': self.failed,
+            'shape': list(self.features.shape),
+            'updated': time.time()
+        })
+
+    @staticmethod
+    def _atomic_write(path: Path, data) -> None:
+        """Writes JSON next to the target and renames it over, so readers never see partial files"""
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+class PipelinedFeatureExtractionJob(FeatureExtractionJob):
+    def __init__(
+        self,
+        extractor,
+        image_loader: ImageLoader,
+        output_dir: str,
+        batch_size: int = 32,
+        checkpoint_every: int = 10,
+        class_name: Optional[str] = None,
+        image_paths: Optional[List[str]] = None,
+        decode_workers: int = 4,
+        queue_size: int = 4,
+        on_batch: Optional[Callable[[int, np.ndarray], None]] = None
+    ):
+        """
+        FeatureExtractionJob whose decoding, inference and writing run concurrently
+
+        A decoding thread pool fills a bounded queue of preprocessed batches, the
+        calling thread runs the model, and a writer thread stores the rows,
+        checkpoints and hands every batch to on_batch (e.g. to accumulate
+        statistics for scoring while extraction is still running). Bounded queues
+        keep memory flat when one stage is slower than the others.
+
+        Args:
+            extractor: FeatureExtractor (needs load_image and predict)
+            image_loader: ImageLoader whose index defines the row order
+            output_dir: Directory holding the matrix, path list and checkpoint
+            batch_size: Number of images passed to the model at once
+            checkpoint_every: Number of batches between two checkpoints
+            class_name: Optional class to restrict the job to
+            image_paths: Explicit paths to process instead of the loader index
+            decode_workers: Number of decoding threads
+            queue_size: Maximum number of batches waiting between two stages
+            on_batch: Optional callback receiving (first_row, features) for every
+                batch in row order, including rows restored from a checkpoint
+        """
+        super().__init__(extractor, image_loader, output_dir, batch_size=batch_size,
+                         checkpoint_every=checkpoint_every, class_name=class_name,
+                         image_paths=image_paths)
+        self.decode_workers = decode_workers
+        self.queue_size = queue_size
+        self.on_batch = on_batch
+
+    def run(self) -> np.memmap:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        total = len(self.image_paths)
+        if total == 0:
+            raise ValueError("No images to extract features from")
+
+        self._resume()
+        if self.completed:
+            logger.info(f"Resuming feature extraction at row {self.completed}/{total}")
+            if self.on_batch:
+                for start in range(0, self.completed, self.batch_size):
+                    end = min(start + self.batch_size, self.completed)
+                    self.on_batch(start, np.asarray(self.features[start:end]))
+
+        decoded: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        extracted: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors: List[BaseException] = []
+
+        decoder = threading.Thread(target=self._decode_loop, args=(self.completed, decoded, stop, errors),
+                                   name="feature-decode", daemon=True)
+        writer = threading.Thread(target=self._write_loop, args=(extracted, stop, errors, total),
+                                  name="feature-write", daemon=True)
+        decoder.start()
+        writer.start()
+
+        try:
+            while not stop.is_set():
+                item = self._get(decoded, stop)
+                if item is None:
+                    break
+                start, arrays = item
+                valid = [i for i, array in enumerate(arrays) if array is not None]
+                rows = None
+                if valid:
+                    features = np.asarray(self.extractor.predict(np.stack([arrays[i] for i in valid])),
+                                          dtype=np.float32)
+                    rows = np.full((len(arrays), features.shape[1]), np.nan, dtype=np.float32)
+                    rows[valid] = features
+                self._put(extracted, (start, len(arrays), rows), stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            self._put(extracted, None, stop)
+            decoder.join()
+            writer.join()
+
+        if errors:
+            raise errors[0]
+        if self.failed:
+            logger.warning(f"{len(self.failed)} images could not be processed")
+        return self.features
+
+    def _decode_loop(self, first_row: int, decoded: "queue.Queue", stop: threading.Event,
+                     errors: List[BaseException]) -> None:
+        try:
+            with ThreadPoolExecutor(max_workers=self.decode_workers) as pool:
+                for start in range(first_row, len(self.image_paths), self.batch_size):
+                    if stop.is_set():
+                        return
+                    paths = self.image_paths[start:start + self.batch_size]
+                    with stage('feature_job.decode', items=len(paths)):
+                        arrays = list(pool.map(self._safe_load, paths))
+                    if not self._put(decoded, (start, arrays), stop):
+                        return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            self._put(decoded, None, stop)
+
+    def _write_loop(self, extracted: "queue.Queue", stop: threading.Event,
+                    errors: List[BaseException], total: int) -> None:
+        start_time = time.time()
+        start_row = self.completed
+        batches_since_checkpoint = 0
+        try:
+            while True:
+                item = self._get(extracted, stop)
+                if item is None:
+                    break
+                start, count, rows = item
+                if rows is None:
+                    self.failed.extend(range(start, start + count))
+                else:
+                    self.failed.extend(int(start + i) for i in np.flatnonzero(np.isnan(rows).all(axis=1)))
+                self._store(start, count, rows)
+                self.completed = start + count
+                if self.completed == total and self.features is None:
+                    self._allocate_unreadable()
+                if self.on_batch and self.features is not None:
+                    self.on_batch(start, np.asarray(self.features[start:start + count]))
+
+                batches_since_checkpoint += 1
+                if self.features is not None and (batches_since_checkpoint >= self.checkpoint_every
+                                                  or self.completed == total):
+                    self._checkpoint()
+                    batches_since_checkpoint = 0
+                    elapsed = time.time() - start_time
+                    rate = (self.completed - start_row) / elapsed if elapsed > 0 else 0.0
+                    logger.info(f"Extracted {self.completed}/{total} images ({rate:.1f} img/s)")
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+            # Keep the rows written since the last checkpoint when the pipeline fails
+            if self.features is not None and self.completed > start_row:
+                try:
+                    self._checkpoint()
+                except Exception:
+                    logger.exception("Could not checkpoint feature extraction")
+
+    def _safe_load(self, path: str) -> Optional[np.ndarray]:
+        try:
+            return self.extractor.load_image(path)
+        except Exception as e:
+            logger.warning(f"Failed to decode {path}: {e}")
+            return None
+
+    @staticmethod
+    def _put(q: "queue.Queue", item, stop: threading.Event) -> bool:
+        """Puts item, giving up once the pipeline is stopping (end markers are always delivered)"""
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if stop.is_set():
+                    if item is None:
+                        # Make room for the end marker, the pending work is discarded anyway
+                        try:
+                            q.get_nowait()
+                        except queue.Empty:
+                            pass
+                        continue
+                    return False
+
+    @staticmethod
+    def _get(q: "queue.Queue", stop: threading.Event):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return None
@@ -0,0 +1,43 @@
+"""
+Shared image decoding helpers
+"""
+
+from typing import Optional, Tuple
+from PIL import Image
+
+from src.utils.shards import image_source
+
+
+def open_image(path: str, target_size: Optional[Tuple[int, int]] = None, mode: str = 'RGB') -> Image.Image:
+    """
+    Opens an image, decoding JPEGs at reduced resolution when possible
+
+    JPEG draft mode lets the decoder skip DCT coefficients and produce an image
+    scaled down by 1/2, 1/4 or 1/8 that is still at least as large as target_size,
+    which is much faster than decoding at full resolution and resizing afterwards.
+
+    Args:
+        path: Path of the image file or shard member
+        target_size: Optional (width, height) the image will be shrunk to by the caller
+        mode: Pillow mode to convert the image to
+
+    Returns:
+        Decoded PIL image (not yet resized to target_size)
+    """
+    img = Image.open(image_source(path))
+    if target_size is not None and img.format == 'JPEG':
+        img.draft(mode, target_size)
+    if img.mode != mode:
+        img = img.convert(mode)
+    else:
+        img.load()
+    return img
+
+
+def load_thumbnail(path: str, size: Tuple[int, int], mode: str = 'RGB') -> Image.Image:
+    """
+    Decodes an image straight to a thumbnail fitting inside size, keeping the aspect ratio
+    """
+    img = open_image(path, target_size=size, mode=mode)
+    img.thumbnail(size, Image.LANCZOS)
+    return img
@@ -1,11 +1,64 @@
 from pathlib import Path
-from typing import List, Set, Dict, Optional
-from collections import defaultdict
+from typing import List, Set, Dict, Optional, Sequence
+from collections import Counter, defaultdict
+from bisect import bisect_right
+import json
+import os
 import random
 import time
 import shutil
 
+from src.utils.profiling import stage
+from src.utils.shards import (
+    SHARD_SUFFIX, get_reader, image_stat, is_shard_member, member_path, pack_images, read_bytes, split_shard_path
+)
+
+def class_of(path: str) -> str:
+    """Class of an image path: the name of its parent folder, without building a Path"""
+    parts = path.rsplit(os.sep, 2)
+    return parts[-2] if len(parts) > 1 else ''
+
+
+class ImagePathView(Sequence):
+    def __init__(self, segments: List[Sequence[str]]):
+        """
+        Read-only sequence over several path lists without concatenating them
+
+        Indexing locates the segment through precomputed offsets, so jumping to
+        any position is cheap even for millions of paths.
+
+        Args:
+            segments: Path lists (e.g. one per class) exposed back to back
+        """
+        self.segments = [segment for segment in segments if len(segment)]
+        self.offsets = []
+        total = 0
+        for segment in self.segments:
+            self.offsets.append(total)
+            total += len(segment)
+        self.total = total
+
+    def __len__(self) -> int:
+        return self.total
+
+    def __iter__(self):
+        for segment in self.segments:
+            yield from segment
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.total))]
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError("ImagePathView index out of range")
+        segment = bisect_right(self.offsets, index) - 1
+        return self.segments[segment][index - self.offsets[segment]]
+
+
 class ImageLoader:
+    FORMAT = 'files'
+
     def __init__(
         self,
         root_path: str,
@@ -18,50 +71,109 @@ class ImageLoader:
         self.dataset_index = {}
         self.class_mapping = {}
         self.class_statistics = {}
+        self.metadata = {}
+        self.index_path = None
         self._scan_directory()
         self.map_class_folders()
 
+    def save_index(self, index_path: str) -> None:
+        """
+        Persists the scanned index so the dataset can be reopened without rescanning
+        
+        The class mapping is stored as positions in the index order, so reopening
+        does not have to derive the class of every path again.
+        
+        Args:
+            index_path: JSON file to write
+        """
+        positions = {path: i for i, path in enumerate(self.get_all_images())}
+        index = {
+            'format': self.FORMAT,
+            'root_path': str(self.root_path),
+            'extensions': sorted(self.extensions),
+            'recursive': self.recursive,
+            'dataset_index': self.dataset_index,
+            'class_positions': {
+                class_name: [positions[path] for path in paths]
+                for class_name, paths in self.class_mapping.items()
+            },
+            'class_statistics': self.class_statistics,
+            'metadata': self.metadata
+        }
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+        self.index_path = str(index_path)
+
+    @classmethod
+    def load_index(cls, index_path: str) -> 'ImageLoader':
+        """
+        Creates an ImageLoader from an index written by save_index, without scanning the disk
+        
+        Args:
+            index_path: JSON file written by save_index
+        """
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get('format') == ShardedImageLoader.FORMAT and not issubclass(cls, ShardedImageLoader):
+            cls = ShardedImageLoader
+        loader = cls.__new__(cls)
+        loader.root_path = Path(index['root_path'])
+        loader.extensions = set(index['extensions'])
+        loader.recursive = index['recursive']
+        loader.dataset_index = index['dataset_index']
+        loader.metadata = index.get('metadata', {})
+        loader.index_path = str(index_path)
+        if 'class_positions' in index:
+            paths = loader.get_all_images()
+            loader.class_mapping = {
+                class_name: [paths[i] for i in positions]
+                for class_name, positions in index['class_positions'].items()
+            }
+            loader.class_statistics = index['class_statistics']
+        else:
+            # Index written before the class mapping was persisted
+            loader.map_class_folders()
+        return loader
+
     def _scan_directory(self) -> None:
         """Scans directory and builds dataset index"""
-        for ext in self.extensions:
-            pattern = f"**/*{ext}" if self.recursive else f"*{ext}"
-            self.dataset_index[ext] = [
-                str(p) for p in self.root_path.glob(pattern)
-            ]
+        with stage('image_loader.scan') as timing:
+            # Extensions match case-insensitively, so IMG_0001.JPG is indexed under '.jpg'
+            found = {ext: [] for ext in sorted({ext.lower() for ext in self.extensions})}
+            for p in self.root_path.glob("**/*" if self.recursive else "*"):
+                ext = p.suffix.lower()
+                if ext in found:
+                    found[ext].append(str(p))
+            # Sorted so the index order is stable across processes and restarts
+            for ext, paths in found.items():
+                self.dataset_index[ext] = sorted(paths)
+                timing.add(items=len(paths))
 
     def map_class_folders(self) -> None:
         """Maps class folders and organizes images by class"""
-        self.class_mapping = defaultdict(list)
+        class_mapping = defaultdict(list)
+        extension_counts = defaultdict(dict)
         
-        for ext_paths in self.dataset_index.values():
-            for path in ext_paths:
-                path_obj = Path(path)
-                # Get the immediate parent folder as class name
-                class_name = path_obj.parent.name
-                self.class_mapping[class_name].append(str(path))
+        for ext, ext_paths in self.dataset_index.items():
+            # The immediate parent folder is the class name
+            classes = [class_of(path) for path in ext_paths]
+            for class_name, path in zip(classes, ext_paths):
+                class_mapping[class_name].append(path)
+            for class_name, count in Counter(classes).items():
+                extension_counts[class_name][ext] = count
         
         # Convert defaultdict to regular dict
-        self.class_mapping = dict(self.class_mapping)
-        self._update_class_statistics()
-
-    def _update_class_statistics(self) -> None:
-        """Updates statistics for each class"""
+        self.class_mapping = dict(class_mapping)
         self.class_statistics = {
             class_name: {
                 'count': len(paths),
-                'extensions': self._count_extensions(paths)
+                'extensions': extension_counts[class_name]
             }
             for class_name, paths in self.class_mapping.items()
         }
 
-    def _count_extensions(self, paths: List[str]) -> Dict[str, int]:
-        """Counts file extensions in a list of paths"""
-        ext_count = defaultdict(int)
-        for path in paths:
-            ext = Path(path).suffix.lower()
-            ext_count[ext] += 1
-        return dict(ext_count)
-
     def get_class_distribution(self) -> Dict[str, int]:
         """Returns the distribution of images across classes"""
         return {
@@ -77,6 +189,31 @@ class ImageLoader:
         """Returns list of all class names"""
         return list(self.class_mapping.keys())
 
+    def view(self, class_names: Optional[List[str]] = None,
+             paths: Optional[Sequence[str]] = None) -> ImagePathView:
+        """
+        Returns a lazy sequence of image paths, optionally filtered
+        
+        Args:
+            class_names: Only expose images of these classes
+            paths: Only expose these paths (e.g. outliers returned by a detector), in their order
+        """
+        if paths is not None:
+            if class_names is None:
+                return ImagePathView([paths])
+            wanted = set(class_names)
+            return ImagePathView([[p for p in paths if class_of(p) in wanted]])
+        if class_names is None:
+            class_names = self.get_class_names()
+        return ImagePathView([self.get_images_by_class(name) for name in class_names])
+
+    def get_all_images(self) -> List[str]:
+        """Returns every image path in dataset index order"""
+        paths = []
+        for ext_paths in self.dataset_index.values():
+            paths.extend(ext_paths)
+        return paths
+
     def get_dataset_stats(self) -> Dict:
         """Returns comprehensive dataset statistics"""
         return {
@@ -86,6 +223,45 @@ class ImageLoader:
             'class_statistics': self.class_statistics
         }
 
+    def get_pixel_stats(
+        self,
+        max_size: Optional[int] = 256,
+        sample_fraction: Optional[float] = None,
+        workers: Optional[int] = None,
+        confidence: float = 0.95,
+        seed: int = 0,
+        use_cache: bool = True
+    ) -> Dict:
+        """
+        Returns per-channel pixel statistics per class and overall (normalization constants)
+        
+        Results are cached in the index metadata, and written back to the index
+        file when the loader was saved to or loaded from one.
+        
+        Args:
+            max_size: Longest side images are reduced to while decoding (None for full resolution)
+            sample_fraction: Optional fraction of each class to read instead of every image
+            workers: Number of worker processes
+            confidence: Confidence level of the bounds on the channel means
+            seed: Seed of the sub-sampling
+            use_cache: Reuse a cached result computed with the same parameters on the same images
+        """
+        from src.utils.pixel_stats import PixelStatsEngine
+        
+        engine = PixelStatsEngine(self, max_size=max_size, sample_fraction=sample_fraction,
+                                  workers=workers, seed=seed)
+        key = f"{engine.cache_key()}|{confidence}"
+        cache = self.metadata.setdefault('pixel_stats', {})
+        if use_cache and key in cache:
+            return cache[key]
+        
+        stats = engine.compute(confidence=confidence)
+        cache.clear()  # Results for an older index or other parameters are rarely reused
+        cache[key] = stats
+        if self.index_path:
+            self.save_index(self.index_path)
+        return stats
+
     def get_batch(self, batch_size: int = 32, class_name: Optional[str] = None) -> List[str]:
         """Returns a batch of image paths, optionally from a specific class"""
         if class_name:
@@ -105,25 +281,29 @@ class ImageLoader:
             'class_validation': {}
         }
         
-        for class_name, paths in self.class_mapping.items():
-            class_stats = {'valid': 0, 'invalid': 0}
-            for path in paths:
-                if self.is_valid_image(path):
-                    class_stats['valid'] += 1
-                else:
-                    class_stats['invalid'] += 1
-            stats['class_validation'][class_name] = class_stats
-            stats['valid_files'] += class_stats['valid']
-            stats['invalid_files'] += class_stats['invalid']
-            stats['total_files'] += len(paths)
+        with stage('image_loader.validate') as timing:
+            for class_name, paths in self.class_mapping.items():
+                class_stats = {'valid': 0, 'invalid': 0}
+                for path in paths:
+                    if self.is_valid_image(path):
+                        class_stats['valid'] += 1
+                    else:
+                        class_stats['invalid'] += 1
+                stats['class_validation'][class_name] = class_stats
+                stats['valid_files'] += class_stats['valid']
+                stats['invalid_files'] += class_stats['invalid']
+                stats['total_files'] += len(paths)
+            timing.add(items=stats['total_files'])
         
         return stats
 
     @staticmethod
     def is_valid_image(file_path: str) -> bool:
-        """Checks if file exists and has non-zero size"""
-        path = Path(file_path)
-        return path.exists() and path.stat().st_size > 0
+        """Checks if file (or shard member) exists and has non-zero size"""
+        try:
+            return image_stat(file_path)[0] > 0
+        except OSError:
+            return False
 
 
 
@@ -174,7 +354,11 @@ class ImageLoader:
                 for img_path in split_images:
                     source = Path(img_path)
                     target = class_dir / source.name
-                    if not target.exists():
+                    if target.exists():
+                        continue
+                    if is_shard_member(img_path):
+                        target.write_bytes(read_bytes(img_path))
+                    else:
                         shutil.copy2(source, target)
         
         # Create new ImageLoader instances
@@ -227,15 +411,24 @@ class ImageLoader:
         
         return dataset, len(class_names)
 
-    def remove_outliers(self, outlier_paths: List[str], move_to: Optional[str] = None):
+    def remove_outliers(self, outlier_paths: List[str], move_to: Optional[str] = None, confirm: bool = True):
         """
         Removes outlier images from the dataset with batch validation
         
+        Moved images keep their path relative to the dataset root, so images with
+        the same name in different class folders do not collide; an existing
+        file at the destination is never overwritten.
+
         Args:
             outlier_paths: List of paths to outlier images
             move_to: Optional path to move outliers instead of deletion
+            confirm: Ask for confirmation on the console first
         """
-        while True:
+        if any(is_shard_member(path) for path in outlier_paths):
+            raise ValueError("Images packed into shards cannot be removed in place; "
+                             "remove them from the source dataset and repack it")
+        response = 'yes'
+        while confirm:
             response = input(f"Proceed with removing {len(outlier_paths)} outliers? (yes/no): ").lower()
             if response in ['yes', 'no']:
                 break
@@ -244,7 +437,8 @@ class ImageLoader:
             if move_to:
                 Path(move_to).mkdir(parents=True, exist_ok=True)
                 for path in outlier_paths:
-                    dest = Path(move_to) / Path(path).name
+                    dest = self._move_destination(path, Path(move_to))
+                    dest.parent.mkdir(parents=True, exist_ok=True)
                     shutil.move(path, dest)
             else:
                 for path in outlier_paths:
@@ -253,3 +447,143 @@ class ImageLoader:
             # Update dataset index and class mapping
             self._scan_directory()
             self.map_class_folders()
+
+    def _move_destination(self, path: str, move_to: Path) -> Path:
+        """Free destination of a moved image under move_to, mirroring its path below the root"""
+        source = Path(path)
+        try:
+            relative = source.relative_to(self.root_path)
+        except ValueError:
+            relative = Path(source.parent.name) / source.name
+        dest = move_to / relative
+        counter = 1
+        while dest.exists():
+            dest = dest.with_name(f"{source.stem}_{counter}{source.suffix}")
+            counter += 1
+        return dest
+
+
+class ShardedImageLoader(ImageLoader):
+    FORMAT = 'shards'
+
+    def __init__(
+        self,
+        root_path: str,
+        extensions: Set[str] = {'.jpg', '.jpeg', '.png'},
+        recursive: bool = True
+    ):
+        """
+        ImageLoader over a dataset packed into tar shards (see src.utils.shards)
+
+        Images are indexed from the shard offset indexes instead of the
+        filesystem, and exposed as virtual paths '<shard>.tar/<class>/<name>'
+        that every reader of the toolbox accepts.
+
+        Args:
+            root_path: Directory holding the '.tar' shards
+            extensions: Image extensions to index
+            recursive: Also look for shards in subdirectories
+        """
+        super().__init__(root_path, extensions=extensions, recursive=recursive)
+
+    @classmethod
+    def pack(
+        cls,
+        image_loader: ImageLoader,
+        output_dir: str,
+        max_bytes: int = 1 << 30,
+        max_images: Optional[int] = None
+    ) -> 'ShardedImageLoader':
+        """
+        Packs the images of a loader, in index order, into shards and indexes them
+
+        The index is saved as output_dir/index.json.
+
+        Args:
+            image_loader: Loader whose images are packed
+            output_dir: Directory receiving the shards
+            max_bytes: Target size of one shard
+            max_images: Optional maximum number of images per shard
+        """
+        pack_images(image_loader.get_all_images(), str(image_loader.root_path), output_dir,
+                    max_bytes=max_bytes, max_images=max_images)
+        loader = cls(output_dir, extensions=image_loader.extensions)
+        loader.save_index(str(Path(output_dir) / 'index.json'))
+        return loader
+
+    def _scan_directory(self) -> None:
+        """Builds the dataset index from the offset indexes of the shards"""
+        with stage('image_loader.scan') as timing:
+            pattern = f"**/*{SHARD_SUFFIX}" if self.recursive else f"*{SHARD_SUFFIX}"
+            self.dataset_index = {ext: [] for ext in sorted(self.extensions)}
+            for shard_path in sorted(str(p) for p in self.root_path.glob(pattern)):
+                reader = get_reader(shard_path)
+                for member in reader.members:
+                    ext = Path(member).suffix.lower()
+                    if ext in self.dataset_index:
+                        self.dataset_index[ext].append(member_path(shard_path, member))
+                timing.add(items=len(reader.members))
+
+    @property
+    def shard_paths(self) -> List[str]:
+        """Shards holding the indexed images, in index order"""
+        shards = {}
+        for path in self.get_all_images():
+            location = split_shard_path(path)
+            if location is not None:
+                shards.setdefault(location[0])
+        return list(shards)
+
+    def iter_images(self, class_name: Optional[str] = None):
+        """
+        Yields (path, encoded bytes) of the indexed images, reading every shard sequentially
+
+        Args:
+            class_name: Optional class to restrict the iteration to
+        """
+        wanted = set(self.get_images_by_class(class_name) if class_name else self.get_all_images())
+        for shard_path in self.shard_paths:
+            for member, data in get_reader(shard_path):
+                path = member_path(shard_path, member)
+                if path in wanted:
+                    yield path, data
+
+    def to_tensorflow(self, img_height=224, img_width=224, batch_size=32):
+        """
+        Converts the sharded dataset to a TensorFlow dataset ready for training
+
+        Shards are visited in a random order and each one is streamed with a
+        single sequential read; the shuffle buffer mixes images across shards.
+
+        Returns:
+            tf_dataset: TensorFlow dataset ready for model training
+            num_classes: Number of classes in the dataset
+        """
+        import tensorflow as tf
+
+        class_names = self.get_class_names()
+        class_to_index = {name: idx for idx, name in enumerate(class_names)}
+        wanted = set(self.get_all_images())
+        shard_paths = self.shard_paths
+
+        def generate():
+            for shard_path in random.sample(shard_paths, len(shard_paths)):
+                for member, data in get_reader(shard_path):
+                    path = member_path(shard_path, member)
+                    if path in wanted:
+                        yield data, class_to_index[class_of(path)]
+
+        def decode_and_preprocess(data, label):
+            img = tf.image.decode_jpeg(data, channels=3)
+            img = tf.image.resize(img, [img_height, img_width])
+            img = img / 255.0
+            return img, label
+
+        dataset = tf.data.Dataset.from_generator(generate, output_signature=(
+            tf.TensorSpec(shape=(), dtype=tf.string),
+            tf.TensorSpec(shape=(), dtype=tf.int32)
+        ))
+        dataset = dataset.map(decode_and_preprocess)
+        dataset = dataset.shuffle(1000).batch(batch_size)
+
+        return dataset, len(class_names)
@@ -0,0 +1,72 @@
+"""
+Streaming, mergeable mean and covariance of feature vectors
+"""
+
+from typing import Optional
+
+import numpy as np
+
+
+class RunningMoments:
+    def __init__(self, dim: Optional[int] = None):
+        """
+        Accumulates the mean and covariance of feature batches
+
+        Batches (and accumulators built elsewhere) are combined with Chan's
+        parallel update of Welford's algorithm, so the result equals the
+        moments of all rows at once. Rows containing NaN are skipped.
+
+        Args:
+            dim: Feature dimension (inferred from the first batch if omitted)
+        """
+        self.n = 0
+        self.mean = np.zeros(dim) if dim else None
+        self.comoment = np.zeros((dim, dim)) if dim else None
+
+    def update(self, batch: np.ndarray) -> 'RunningMoments':
+        """Adds a batch of shape (rows, dim)"""
+        batch = np.asarray(batch, dtype=np.float64)
+        batch = batch[np.isfinite(batch).all(axis=1)]
+        if len(batch) == 0:
+            return self
+        other = RunningMoments()
+        other.n = len(batch)
+        other.mean = batch.mean(axis=0)
+        centered = batch - other.mean
+        other.comoment = centered.T @ centered
+        return self.merge(other)
+
+    def merge(self, other: 'RunningMoments') -> 'RunningMoments':
+        """Folds another accumulator into this one and returns self"""
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n = other.n
+            self.mean = np.copy(other.mean)
+            self.comoment = np.copy(other.comoment)
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.comoment = self.comoment + other.comoment + np.outer(delta, delta) * self.n * other.n / n
+        self.mean = self.mean + delta * other.n / n
+        self.n = n
+        return self
+
+    def covariance(self, ddof: int = 1) -> np.ndarray:
+        """Covariance matrix, matching np.cov(rows, rowvar=False) for ddof=1"""
+        if self.n <= ddof:
+            raise ValueError("Not enough rows to estimate a covariance")
+        return self.comoment / (self.n - ddof)
+
+    def save(self, path: str) -> None:
+        """Writes the accumulator to an .npz file"""
+        np.savez(path, n=self.n, mean=self.mean, comoment=self.comoment)
+
+    @classmethod
+    def load(cls, path: str) -> 'RunningMoments':
+        data = np.load(path)
+        moments = cls()
+        moments.n = int(data['n'])
+        moments.mean = data['mean']
+        moments.comoment = data['comoment']
+        return moments
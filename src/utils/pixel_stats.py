@@ -0,0 +1,282 @@
+"""
+Mergeable per-channel pixel statistics for dataset normalization constants
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.utils.image_io import open_image
+
+logger = logging.getLogger(__name__)
+
+# Subtracted from image means before squaring to keep the sums well conditioned
+_CENTRE = 127.5
+
+
+class PixelStatsAccumulator:
+    def __init__(self, channels: int = 3):
+        """
+        Streaming per-channel statistics that can be merged across workers
+
+        Pixel moments are combined with Chan's parallel variance formula, so
+        accumulators built on separate chunks merge into exactly the statistics
+        of the whole set. Sums over per-image channel means are tracked as well,
+        since pixels of one image are correlated and the image is the sampling
+        unit for confidence bounds.
+
+        Args:
+            channels: Number of channels of the images
+        """
+        self.channels = channels
+        self.n_images = 0
+        self.n_failed = 0
+        self.n_pixels = 0
+        self.mean = np.zeros(channels)
+        self.m2 = np.zeros(channels)
+        self.histogram = np.zeros((channels, 256), dtype=np.int64)
+        self.min = np.full(channels, np.inf)
+        self.max = np.full(channels, -np.inf)
+        # Sums of n_i^2, n_i^2 * d_i and n_i^2 * d_i^2 over images, with n_i the
+        # pixel count and d_i the channel means minus a fixed centre (for precision)
+        self.sq_pixels = 0.0
+        self.sq_weighted_means = np.zeros(channels)
+        self.sq_weighted_means2 = np.zeros(channels)
+
+    def update(self, img: np.ndarray) -> 'PixelStatsAccumulator':
+        """Adds one uint8 image of shape (height, width, channels)"""
+        pixels = img.reshape(-1, self.channels)
+        n = pixels.shape[0]
+        if n == 0:
+            return self
+        values = pixels.astype(np.float64)
+        mean = values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+
+        other = PixelStatsAccumulator(self.channels)
+        other.n_images = 1
+        other.n_pixels = n
+        other.mean = mean
+        other.m2 = m2
+        for channel in range(self.channels):
+            other.histogram[channel] = np.bincount(pixels[:, channel], minlength=256)[:256]
+        other.min = pixels.min(axis=0).astype(np.float64)
+        other.max = pixels.max(axis=0).astype(np.float64)
+        centred = mean - _CENTRE
+        other.sq_pixels = float(n) ** 2
+        other.sq_weighted_means = other.sq_pixels * centred
+        other.sq_weighted_means2 = other.sq_pixels * centred ** 2
+        return self.merge(other)
+
+    def merge(self, other: 'PixelStatsAccumulator') -> 'PixelStatsAccumulator':
+        """Folds another accumulator into this one and returns self"""
+        self.n_failed += other.n_failed
+        if other.n_images == 0:
+            return self
+        if self.n_images == 0:
+            self.__dict__.update({key: np.copy(value) if isinstance(value, np.ndarray) else value
+                                  for key, value in other.__dict__.items()
+                                  if key != 'n_failed'})
+            return self
+
+        # Pixel moments weighted by pixel counts
+        n = self.n_pixels + other.n_pixels
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n_pixels / n
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.n_pixels * other.n_pixels / n
+        self.n_pixels = n
+
+        self.sq_pixels += other.sq_pixels
+        self.sq_weighted_means = self.sq_weighted_means + other.sq_weighted_means
+        self.sq_weighted_means2 = self.sq_weighted_means2 + other.sq_weighted_means2
+        self.n_images += other.n_images
+
+        self.histogram += other.histogram
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        return self
+
+    def summary(self, confidence: float = 0.95, population: Optional[int] = None) -> Dict:
+        """
+        Returns JSON-serializable statistics
+
+        Args:
+            confidence: Confidence level of the bounds on the channel means
+            population: Number of images the accumulator was sampled from, enabling
+                the finite population correction when sub-sampling
+
+        Returns:
+            Dictionary with per-channel mean/std (0-255 and 0-1 scale), min, max,
+            256-bin histograms, counts and confidence bounds on the pixel-weighted means
+        """
+        if self.n_images == 0:
+            return {'n_images': 0, 'n_failed': self.n_failed}
+
+        std = np.sqrt(self.m2 / self.n_pixels)
+        half_width = np.zeros(self.channels)
+        if self.n_images > 1:
+            # The pixel-weighted mean is a ratio estimator over images (sum of
+            # n_i * m_i over sum of n_i); its variance is estimated from the
+            # residuals n_i * (m_i - mean), so larger images weigh more
+            z = NormalDist().inv_cdf(0.5 + confidence / 2)
+            k = self.n_images
+            ratio = self.mean - _CENTRE
+            residuals = (self.sq_weighted_means2 - 2 * ratio * self.sq_weighted_means
+                         + ratio ** 2 * self.sq_pixels)
+            mean_pixels = self.n_pixels / k
+            variance = np.maximum(residuals, 0) / (k - 1) / (k * mean_pixels ** 2)
+            correction = 1.0
+            if population and population > k:
+                correction = (population - k) / (population - 1)
+            half_width = z * np.sqrt(variance * correction)
+
+        return {
+            'n_images': self.n_images,
+            'n_failed': self.n_failed,
+            'n_pixels': self.n_pixels,
+            'mean': self.mean.tolist(),
+            'std': std.tolist(),
+            'mean_normalized': (self.mean / 255.0).tolist(),
+            'std_normalized': (std / 255.0).tolist(),
+            'min': self.min.tolist(),
+            'max': self.max.tolist(),
+            'histogram': self.histogram.tolist(),
+            'confidence': confidence,
+            'mean_lower': (self.mean - half_width).tolist(),
+            'mean_upper': (self.mean + half_width).tolist()
+        }
+
+    def to_dict(self) -> Dict:
+        """Serializes the raw accumulator state, e.g. to send it between processes or nodes"""
+        return {
+            key: value.tolist() if isinstance(value, np.ndarray) else value
+            for key, value in self.__dict__.items()
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> 'PixelStatsAccumulator':
+        accumulator = cls(state['channels'])
+        for key, value in state.items():
+            if isinstance(getattr(accumulator, key), np.ndarray):
+                value = np.asarray(value, dtype=getattr(accumulator, key).dtype)
+            setattr(accumulator, key, value)
+        return accumulator
+
+
+def accumulate_paths(paths: List[str], max_size: Optional[int] = 256, mode: str = 'RGB') -> Dict:
+    """
+    Builds the accumulator state of a list of images (runs inside worker processes)
+
+    Args:
+        paths: Images to read
+        max_size: Longest side images are reduced to while decoding (None for full resolution)
+        mode: Pillow mode images are converted to
+
+    Returns:
+        PixelStatsAccumulator.to_dict() of the images
+    """
+    accumulator = PixelStatsAccumulator(len(mode))
+    size = (max_size, max_size) if max_size else None
+    for path in paths:
+        try:
+            img = open_image(path, target_size=size, mode=mode)
+            if size:
+                img.thumbnail(size)
+            accumulator.update(np.asarray(img, dtype=np.uint8).reshape(img.height, img.width, -1))
+        except Exception as e:
+            logger.debug(f"Skipping {path} in pixel statistics: {e}")
+            accumulator.n_failed += 1
+    return accumulator.to_dict()
+
+
+class PixelStatsEngine:
+    def __init__(
+        self,
+        image_loader,
+        max_size: Optional[int] = 256,
+        sample_fraction: Optional[float] = None,
+        workers: Optional[int] = None,
+        chunk_size: int = 256,
+        seed: int = 0,
+        mode: str = 'RGB'
+    ):
+        """
+        Computes per-class and overall pixel statistics in one parallel pass
+
+        Args:
+            image_loader: ImageLoader providing the classes and paths
+            max_size: Longest side images are reduced to while decoding (None for full resolution).
+                Means are barely affected, stds shrink slightly as fine detail is averaged out.
+            sample_fraction: Optional fraction of each class to read instead of every image
+            workers: Number of worker processes (defaults to os.cpu_count(); 1 runs in-process)
+            chunk_size: Number of images per task sent to a worker
+            seed: Seed of the sub-sampling
+            mode: Pillow mode images are converted to
+        """
+        self.image_loader = image_loader
+        self.max_size = max_size
+        self.sample_fraction = sample_fraction
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.mode = mode
+
+    def cache_key(self) -> str:
+        """Identifies a result by its parameters and the exact list of indexed images"""
+        digest = hashlib.sha1()
+        for class_name in sorted(self.image_loader.get_class_names()):
+            digest.update(class_name.encode('utf-8'))
+            for path in self.image_loader.get_images_by_class(class_name):
+                digest.update(path.encode('utf-8'))
+        params = json.dumps([self.max_size, self.sample_fraction, self.seed, self.mode])
+        return f"{params}|{digest.hexdigest()}"
+
+    def compute(self, confidence: float = 0.95) -> Dict:
+        """
+        Runs the pass and reduces the worker accumulators per class and overall
+
+        Returns:
+            Dictionary with an 'overall' summary and one summary per class in 'classes'
+        """
+        tasks: List[Tuple[str, List[str]]] = []
+        population = {}
+        rng = random.Random(self.seed)
+        for class_name in self.image_loader.get_class_names():
+            paths = self.image_loader.get_images_by_class(class_name)
+            population[class_name] = len(paths)
+            if self.sample_fraction is not None and self.sample_fraction < 1:
+                paths = rng.sample(paths, max(1, int(round(len(paths) * self.sample_fraction)))) if paths else []
+            for start in range(0, len(paths), self.chunk_size):
+                tasks.append((class_name, paths[start:start + self.chunk_size]))
+
+        per_class = {class_name: PixelStatsAccumulator(len(self.mode)) for class_name in population}
+        for class_name, state in zip((name for name, _ in tasks), self._run(tasks)):
+            per_class[class_name].merge(PixelStatsAccumulator.from_dict(state))
+
+        overall = PixelStatsAccumulator(len(self.mode))
+        for accumulator in per_class.values():
+            overall.merge(accumulator)
+
+        sampled = self.sample_fraction is not None and self.sample_fraction < 1
+        return {
+            'overall': overall.summary(confidence, sum(population.values()) if sampled else None),
+            'classes': {
+                class_name: accumulator.summary(confidence, population[class_name] if sampled else None)
+                for class_name, accumulator in per_class.items()
+            }
+        }
+
+    def _run(self, tasks: List[Tuple[str, List[str]]]):
+        paths = [chunk for _, chunk in tasks]
+        if self.workers == 1 or len(tasks) <= 1:
+            return [accumulate_paths(chunk, self.max_size, self.mode) for chunk in paths]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(accumulate_paths, paths,
+                                     [self.max_size] * len(paths), [self.mode] * len(paths)))
@@ -0,0 +1,124 @@
+"""
+Background decoding of upcoming images into a memory-bounded LRU cache
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image
+
+from src.utils.image_io import open_image
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, Tuple[int, int]]
+
+
+def decode_to_fit(path: str, size: Tuple[int, int]) -> Image.Image:
+    """
+    Decodes an image scaled to fit inside size while keeping its aspect ratio
+
+    JPEGs are shrunk by the decoder itself (draft mode) before the final resize.
+    """
+    img = open_image(path, target_size=size)
+    ratio = min(size[0] / img.width, size[1] / img.height)
+    new_size = (max(1, int(img.width * ratio)), max(1, int(img.height * ratio)))
+    if new_size != img.size:
+        img = img.resize(new_size, Image.LANCZOS)
+    return img
+
+
+class ImagePrefetcher:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, workers: int = 2):
+        """
+        Decodes and resizes images on worker threads ahead of display
+
+        Decoded RGB images are kept in an LRU bounded by their pixel memory, so
+        they can be turned into ImageTk.PhotoImage objects instantly on the UI thread.
+
+        Args:
+            max_bytes: Maximum memory used by cached bitmaps
+            workers: Number of decoding threads
+        """
+        self.max_bytes = max_bytes
+        self.cache: "OrderedDict[CacheKey, Image.Image]" = OrderedDict()
+        self.cache_bytes = 0
+        self.pending: Dict[CacheKey, Future] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+    def get(self, path: str, size: Tuple[int, int]) -> Image.Image:
+        """
+        Returns the image resized to fit size, waiting for or performing the decode if needed
+        """
+        key = (path, tuple(size))
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            future = self.pending.get(key)
+
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception:
+                pass  # Fall through and surface the error from a synchronous decode
+
+        img = decode_to_fit(path, key[1])
+        self._store(key, img)
+        return img
+
+    def prefetch(self, paths: Iterable[str], size: Tuple[int, int]) -> None:
+        """
+        Schedules background decoding of paths, nearest first
+
+        Queued decodes for images that are no longer requested are cancelled so
+        fast navigation does not build up a backlog.
+        """
+        size = tuple(size)
+        wanted = [(path, size) for path in paths]
+        with self.lock:
+            for key, future in list(self.pending.items()):
+                if key not in wanted and future.cancel():
+                    del self.pending[key]
+            for key in wanted:
+                if key in self.cache or key in self.pending:
+                    continue
+                self.pending[key] = self.executor.submit(self._decode, key)
+
+    def clear(self) -> None:
+        """Drops every cached bitmap, e.g. after the display size changed"""
+        with self.lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+
+    def close(self) -> None:
+        """Stops the worker threads"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _decode(self, key: CacheKey) -> Optional[Image.Image]:
+        try:
+            img = decode_to_fit(*key)
+        except Exception as e:
+            logger.debug(f"Prefetch of {key[0]} failed: {e}")
+            with self.lock:
+                self.pending.pop(key, None)
+            raise
+        self._store(key, img)
+        return img
+
+    def _store(self, key: CacheKey, img: Image.Image) -> None:
+        nbytes = img.width * img.height * len(img.getbands())
+        with self.lock:
+            self.pending.pop(key, None)
+            if key in self.cache:
+                return
+            self.cache[key] = img
+            self.cache_bytes += nbytes
+            # Evict least recently used bitmaps, always keeping the newest one
+            while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.cache_bytes -= evicted.width * evicted.height * len(evicted.getbands())
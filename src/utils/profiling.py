@@ -0,0 +1,305 @@
+"""
+Lightweight stage timing and throughput instrumentation
+
+Disabled by default; enable it with instrumentation.enable() or by setting the
+IMAGE_STATS_PROFILE environment variable to 1. While disabled, stage() returns a
+shared no-op context manager, so instrumented code pays one attribute check.
+
+While stages run, a background thread samples the resident set size, so every
+stage reports the peak RSS observed during its own run (peak_rss) next to the
+peak of the whole process so far (process_peak_rss).
+
+    from src.utils.profiling import instrumentation
+
+    instrumentation.enable()
+    loader = ImageLoader("data")
+    features = FeatureExtractor().batch_extract(loader.get_all_images())
+    instrumentation.save_report("report.json")
+    instrumentation.save_chrome_trace("trace.json")  # open in chrome://tracing or Perfetto
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterable, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Current resident set size of the process, if the platform reports it"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of the whole process since it started, if the platform reports it"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+class _NullStage:
+    """Stand-in returned while instrumentation is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, items: int = 0, bytes_read: int = 0, paths: Optional[Iterable[str]] = None) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, owner: 'Instrumentation', name: str, items: int,
+                 bytes_read: int, paths: Optional[Iterable[str]]):
+        self.owner = owner
+        self.name = name
+        self.items = items
+        self.bytes_read = bytes_read
+        self.paths = list(paths) if paths is not None else []
+        self.peak_rss = None
+
+    def add(self, items: int = 0, bytes_read: int = 0, paths: Optional[Iterable[str]] = None) -> None:
+        """Adds work done inside the stage; paths are counted as bytes read at exit"""
+        self.items += items
+        self.bytes_read += bytes_read
+        if paths is not None:
+            self.paths.extend(paths)
+
+    def observe(self, rss: Optional[int]) -> None:
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def __enter__(self):
+        self.owner._activate(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self.owner._deactivate(self)
+        for path in self.paths:
+            try:
+                self.bytes_read += os.path.getsize(path)
+            except OSError:
+                pass
+        self.owner._record({
+            'name': self.name,
+            'start': self.start,
+            'duration': end - self.start,
+            'items': self.items,
+            'bytes_read': self.bytes_read,
+            'peak_rss': self.peak_rss,
+            'process_peak_rss': peak_rss_bytes(),
+            'thread': threading.get_ident(),
+            'error': exc_type.__name__ if exc_type else None
+        })
+        return False
+
+
+class Instrumentation:
+    def __init__(self, enabled: bool = False, sample_interval: float = 0.01,
+                 max_trace_records: int = 100_000):
+        """
+        Registry of timed stages
+
+        Stages are aggregated by name as they finish, so stages entered millions
+        of times cost constant memory; only the most recent calls are kept
+        individually for the Chrome trace.
+
+        Args:
+            enabled: Whether stages are recorded
+            sample_interval: Seconds between two RSS samples while stages run
+            max_trace_records: Number of most recent stage calls kept for the Chrome trace
+        """
+        self.enabled = enabled
+        self.sample_interval = sample_interval
+        self.records: deque = deque(maxlen=max_trace_records)
+        self.totals: Dict[str, Dict] = OrderedDict()
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self._active = set()
+        self._active_changed = threading.Condition(threading.Lock())
+        self._sampler = None
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self.lock:
+            self.records.clear()
+            self.totals.clear()
+            self.origin = time.perf_counter()
+
+    def stage(self, name: str, items: int = 0, bytes_read: int = 0,
+              paths: Optional[Iterable[str]] = None):
+        """
+        Context manager timing a stage
+
+        Args:
+            name: Stage name, e.g. 'image_loader.scan'
+            items: Number of items (images, rows) processed
+            bytes_read: Number of bytes read
+            paths: Files read by the stage; their sizes are added to bytes_read
+                (only looked up while enabled)
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, items, bytes_read, paths)
+
+    def timed(self, name: Optional[str] = None, items: Optional[Callable] = None) -> Callable:
+        """
+        Decorator timing every call of a function as a stage
+
+        Args:
+            name: Stage name (defaults to the qualified function name)
+            items: Optional callable receiving the call arguments and returning the item count
+        """
+        def decorator(func):
+            stage_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                count = items(*args, **kwargs) if items else 0
+                with self.stage(stage_name, items=count):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _activate(self, stage: _Stage) -> None:
+        stage.observe(current_rss_bytes())
+        with self._active_changed:
+            self._active.add(stage)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name="rss-sampler", daemon=True)
+                self._sampler.start()
+            self._active_changed.notify()
+
+    def _deactivate(self, stage: _Stage) -> None:
+        with self._active_changed:
+            self._active.discard(stage)
+        stage.observe(current_rss_bytes())
+
+    def _sample_loop(self) -> None:
+        """Samples the RSS into every running stage; idles while no stage runs"""
+        while True:
+            with self._active_changed:
+                while not self._active:
+                    self._active_changed.wait()
+                stages = list(self._active)
+            rss = current_rss_bytes()
+            if rss is None:
+                return
+            for stage in stages:
+                stage.observe(rss)
+            time.sleep(self.sample_interval)
+
+    def _record(self, record: Dict) -> None:
+        with self.lock:
+            self.records.append(record)
+            entry = self.totals.get(record['name'])
+            if entry is None:
+                entry = self.totals[record['name']] = {
+                    'calls': 0, 'wall_time': 0.0, 'items': 0, 'bytes_read': 0,
+                    'peak_rss': None, 'process_peak_rss': None, 'errors': 0
+                }
+            entry['calls'] += 1
+            entry['wall_time'] += record['duration']
+            entry['items'] += record['items']
+            entry['bytes_read'] += record['bytes_read']
+            entry['errors'] += record['error'] is not None
+            for key in ('peak_rss', 'process_peak_rss'):
+                if record[key] is not None:
+                    entry[key] = max(entry[key] or 0, record[key])
+
+    def report(self) -> Dict[str, Dict]:
+        """
+        Aggregates the recorded stages by name
+
+        Returns:
+            Per stage: number of calls, total wall time, items, items/s, bytes read,
+            MB/s, the peak RSS sampled while the stage ran and the peak RSS of
+            the process up to its end
+        """
+        with self.lock:
+            stages = {name: dict(entry) for name, entry in self.totals.items()}
+
+        for entry in stages.values():
+            wall_time = entry['wall_time']
+            entry['items_per_second'] = entry['items'] / wall_time if wall_time > 0 and entry['items'] else None
+            entry['mb_per_second'] = entry['bytes_read'] / wall_time / 1e6 if wall_time > 0 and entry['bytes_read'] else None
+        return stages
+
+    def save_report(self, path: str) -> None:
+        """Writes the aggregated report as JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
+    def chrome_trace(self) -> Dict:
+        """Most recent stage calls (up to max_trace_records) in the Chrome trace event format"""
+        pid = os.getpid()
+        with self.lock:
+            records = list(self.records)
+        events = [
+            {
+                'name': record['name'],
+                'ph': 'X',
+                'ts': (record['start'] - self.origin) * 1e6,
+                'dur': record['duration'] * 1e6,
+                'pid': pid,
+                'tid': record['thread'],
+                'args': {
+                    'items': record['items'],
+                    'bytes_read': record['bytes_read'],
+                    'peak_rss': record['peak_rss'],
+                    'process_peak_rss': record['process_peak_rss'],
+                    'error': record['error']
+                }
+            }
+            for record in records
+        ]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, path: str) -> None:
+        """Writes a trace file viewable in chrome://tracing or Perfetto"""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+instrumentation = Instrumentation(
+    enabled=os.environ.get("IMAGE_STATS_PROFILE", "").strip().lower() not in ("", "0", "false", "no", "off")
+)
+stage = instrumentation.stage
+timed = instrumentation.timed
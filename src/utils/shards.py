@@ -0,0 +1,337 @@
+"""
+Tar shard dataset format for datasets of many small images
+
+Images are packed in index order into large tar files (WebDataset style: every
+image member is followed by a '<key>.cls' member holding its class). Next to
+every shard, '<shard>.idx.json' stores the offset and size of each image, so a
+single image is read from a memory map without scanning the archive, while a
+whole shard can be streamed with one sequential read.
+
+A packed image is addressed by a virtual path made of the shard path and the
+member name, e.g. 'shards/shard-00000.tar/cats/0001.jpg'. Its parent folder is
+still the class, and image_source / read_bytes / image_stat accept both virtual
+and regular paths, so the rest of the toolbox works on shards unchanged.
+
+Usage:
+    python -m src.utils.shards index.json /data/shards --shard-size 1024
+"""
+
+import argparse
+import io
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+import tarfile
+import threading
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from src.utils.profiling import stage
+
+logger = logging.getLogger(__name__)
+
+SHARD_SUFFIX = '.tar'
+INDEX_SUFFIX = '.idx.json'
+
+_TAR_COMPONENT = re.compile(r'\.tar(?=[\\/].)')
+_readers: Dict[str, 'ShardReader'] = {}
+_readers_lock = threading.Lock()
+
+
+def split_shard_path(path: str) -> Optional[Tuple[str, str]]:
+    """
+    Splits a virtual path into the shard file and the member name
+
+    Returns:
+        (shard path, member name), or None if path is a regular file path
+    """
+    path = str(path)
+    # Any '.tar' component may be the shard: earlier ones can be directories named like one
+    for match in _TAR_COMPONENT.finditer(path):
+        shard_path = path[:match.end()]
+        if shard_path in _readers or os.path.isfile(shard_path):
+            return shard_path, path[match.end() + 1:].replace('\\', '/')
+    return None
+
+
+def member_path(shard_path: str, member: str) -> str:
+    """Virtual path of a member of a shard"""
+    return os.path.join(shard_path, *member.split('/'))
+
+
+def get_reader(shard_path: str) -> 'ShardReader':
+    """Returns the reader of a shard, shared by all threads of the process"""
+    reader = _readers.get(shard_path)
+    if reader is None:
+        with _readers_lock:
+            reader = _readers.get(shard_path)
+            if reader is None:
+                reader = _readers[shard_path] = ShardReader(shard_path)
+    return reader
+
+
+def image_source(path: str) -> Union[str, BinaryIO]:
+    """Something PIL, skimage and friends can open: the path itself, or an in-memory file for shard members"""
+    location = split_shard_path(path)
+    if location is None:
+        return path
+    return io.BytesIO(get_reader(location[0]).read(location[1]))
+
+
+def read_bytes(path: str) -> bytes:
+    """Reads the encoded bytes of an image file or shard member"""
+    location = split_shard_path(path)
+    if location is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    return get_reader(location[0]).read(location[1])
+
+
+def image_stat(path: str) -> Tuple[int, int]:
+    """
+    Size and modification time (ns) of an image file or shard member
+
+    Members report the modification time of their shard.
+
+    Raises:
+        OSError: If the file or member does not exist
+    """
+    location = split_shard_path(path)
+    if location is None:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    reader = get_reader(location[0])
+    if location[1] not in reader.members:
+        raise FileNotFoundError(f"No member {location[1]} in {location[0]}")
+    return reader.members[location[1]][1], reader.mtime_ns
+
+
+def is_shard_member(path: str) -> bool:
+    return split_shard_path(path) is not None
+
+
+class ShardReader:
+    def __init__(self, shard_path: str):
+        """
+        Random and sequential access to the images of one shard
+
+        The offset index is read from the '.idx.json' file written by
+        ShardWriter, or rebuilt from the tar headers for shards packed elsewhere.
+
+        Args:
+            shard_path: Path of the tar file
+        """
+        self.shard_path = str(shard_path)
+        self.mtime_ns = os.stat(self.shard_path).st_mtime_ns
+        self.members: Dict[str, Tuple[int, int]] = {}
+        self.classes: Dict[str, str] = {}
+        self._map = None
+        self._lock = threading.Lock()
+
+        index_path = self.shard_path + INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                for name, offset, size, class_name in json.load(f)['members']:
+                    self.members[name] = (offset, size)
+                    self.classes[name] = class_name
+        else:
+            self._index_from_headers()
+
+    def _index_from_headers(self) -> None:
+        with tarfile.open(self.shard_path, 'r:') as tar:
+            for info in tar:
+                if info.isfile() and not info.name.endswith('.cls'):
+                    self.members[info.name] = (info.offset_data, info.size)
+                    self.classes[info.name] = Path(info.name).parent.name
+
+    def read(self, member: str) -> bytes:
+        """Reads one member by offset through a memory map of the shard"""
+        offset, size = self.members[member]
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    with open(self.shard_path, 'rb') as f:
+                        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[offset:offset + size]
+
+    def __iter__(self) -> Iterator[Tuple[str, bytes]]:
+        """Yields (member, bytes) of every image in shard order with one sequential read"""
+        members = sorted(self.members.items(), key=lambda item: item[1][0])
+        with stage('shards.read_sequential', items=len(members), paths=[self.shard_path]):
+            # Members are visited by increasing offset, so the buffered reader only moves forward
+            with open(self.shard_path, 'rb', buffering=1 << 20) as f:
+                for name, (offset, size) in members:
+                    f.seek(offset)
+                    yield name, f.read(size)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class ShardWriter:
+    def __init__(
+        self,
+        output_dir: str,
+        max_bytes: int = 1 << 30,
+        max_images: Optional[int] = None,
+        prefix: str = 'shard'
+    ):
+        """
+        Writes images into numbered tar shards with their offset indexes
+
+        Args:
+            output_dir: Directory receiving the shards
+            max_bytes: Size after which a new shard is started
+            max_images: Optional number of images after which a new shard is started
+            prefix: File name prefix of the shards
+        """
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_images = max_images
+        self.prefix = prefix
+        self.shard_paths: List[str] = []
+        self._tar = None
+        self._members = []
+
+    def add(self, member: str, data: bytes, class_name: str, mtime: float = 0) -> str:
+        """
+        Appends an image and its class to the current shard
+
+        Args:
+            member: Member name of the image, e.g. 'cats/0001.jpg'
+            data: Encoded image bytes
+            class_name: Class stored in the '<key>.cls' member
+            mtime: Modification time recorded in the tar header
+
+        Returns:
+            Virtual path of the packed image
+        """
+        if self._tar is not None and (self._tar.offset >= self.max_bytes or
+                                      (self.max_images and len(self._members) >= self.max_images)):
+            self._finish_shard()
+        if self._tar is None:
+            shard_path = self.output_dir / f"{self.prefix}-{len(self.shard_paths):05d}{SHARD_SUFFIX}"
+            self.shard_paths.append(str(shard_path))
+            self._tar = tarfile.open(shard_path, 'w', format=tarfile.PAX_FORMAT)
+            self._members = []
+
+        offset = self._add_member(member, data, mtime)
+        self._members.append([member, offset, len(data), class_name])
+        self._add_member(f"{member.rsplit('.', 1)[0]}.cls", class_name.encode('utf-8'), mtime)
+        return member_path(self.shard_paths[-1], member)
+
+    def _add_member(self, name: str, data: bytes, mtime: float) -> int:
+        """Writes a member and returns the offset of its data"""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+        # The data ends where the next header starts, padded to whole blocks
+        return self._tar.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def _finish_shard(self) -> None:
+        self._tar.close()
+        self._tar = None
+        index_path = self.shard_paths[-1] + INDEX_SUFFIX
+        with open(f"{index_path}.tmp", 'w') as f:
+            json.dump({'members': self._members}, f)
+        os.replace(f"{index_path}.tmp", index_path)
+        with _readers_lock:
+            _readers.pop(self.shard_paths[-1], None)
+
+    def close(self) -> List[str]:
+        """Finishes the last shard and returns the paths of all shards"""
+        if self._tar is not None:
+            self._finish_shard()
+        return self.shard_paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def pack_images(
+    image_paths: List[str],
+    root_path: str,
+    output_dir: str,
+    max_bytes: int = 1 << 30,
+    max_images: Optional[int] = None
+) -> List[str]:
+    """
+    Packs images into tar shards in the given order
+
+    Member names are the paths relative to root_path (class folder included),
+    so virtual paths keep the class as their parent folder.
+
+    Args:
+        image_paths: Images to pack, regular files or members of other shards
+        root_path: Dataset root the member names are made relative to
+        output_dir: Directory receiving the shards
+        max_bytes: Target size of one shard
+        max_images: Optional maximum number of images per shard
+
+    Returns:
+        Paths of the written shards
+    """
+    root_path = Path(root_path)
+    skipped = 0
+    with stage('shards.pack', items=len(image_paths)):
+        with ShardWriter(output_dir, max_bytes=max_bytes, max_images=max_images) as writer:
+            for count, path in enumerate(image_paths, 1):
+                location = split_shard_path(path)
+                member = location[1] if location else None
+                try:
+                    data = read_bytes(path)
+                    mtime = image_stat(path)[1] / 1e9
+                except OSError as e:
+                    logger.warning(f"Skipping unreadable image {path}: {e}")
+                    skipped += 1
+                    continue
+                if member is None:
+                    try:
+                        member = Path(path).relative_to(root_path).as_posix()
+                    except ValueError:
+                        member = f"{Path(path).parent.name}/{Path(path).name}"
+                writer.add(member, data, Path(path).parent.name, mtime)
+                if count % 10000 == 0:
+                    logger.info(f"Packed {count}/{len(image_paths)} images into {len(writer.shard_paths)} shards")
+    if skipped:
+        logger.warning(f"{skipped} images could not be read and were not packed")
+    return writer.shard_paths
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Console entry point"""
+    from src.utils.image_loader import ImageLoader, ShardedImageLoader
+
+    parser = argparse.ArgumentParser(description="Pack an indexed dataset into tar shards")
+    parser.add_argument("source", help="Index written by ImageLoader.save_index, or a dataset directory")
+    parser.add_argument("output_dir", help="Directory receiving the shards and their index.json")
+    parser.add_argument("--shard-size", type=int, default=1024, help="Target shard size in MB")
+    parser.add_argument("--max-images", type=int, help="Maximum number of images per shard")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if os.path.isdir(args.source):
+        loader = ImageLoader(args.source)
+    else:
+        loader = ImageLoader.load_index(args.source)
+    sharded = ShardedImageLoader.pack(loader, args.output_dir, max_bytes=args.shard_size << 20,
+                                      max_images=args.max_images)
+    print(json.dumps({'shards': len(sharded.shard_paths), 'images': len(sharded.get_all_images()),
+                      'index': sharded.index_path}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
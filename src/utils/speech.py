@@ -0,0 +1,176 @@
+"""
+Background speech recording and recognition with pluggable,
+optionally offline, recognizer backends
+"""
+
+import json
+import logging
+import queue
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+import speech_recognition as sr
+
+logger = logging.getLogger(__name__)
+
+
+class SpeechBackend(ABC):
+    """Turns recorded audio into text"""
+
+    @abstractmethod
+    def recognize(self, recognizer: sr.Recognizer, audio: sr.AudioData) -> str:
+        """
+        Transcribes audio
+
+        Raises:
+            sr.UnknownValueError: If the speech could not be understood
+            sr.RequestError: If the recognizer itself is unavailable
+        """
+        pass
+
+
+class GoogleBackend(SpeechBackend):
+    """Google Web Speech API (needs network access)"""
+
+    def __init__(self, language: str = "en-US"):
+        self.language = language
+
+    def recognize(self, recognizer, audio):
+        return recognizer.recognize_google(audio, language=self.language)
+
+
+class VoskBackend(SpeechBackend):
+    """Offline recognition with a Vosk model, loaded once and reused"""
+
+    SAMPLE_RATE = 16000
+
+    def __init__(self, model_path: Optional[str] = None, lang: str = "en-us"):
+        """
+        Args:
+            model_path: Directory of an unpacked Vosk model; if omitted, a model for lang is fetched by vosk
+            lang: Language of the model used when no model_path is given
+        """
+        try:
+            import vosk
+        except ImportError as e:
+            raise ImportError("VoskBackend requires the 'vosk' package") from e
+        vosk.SetLogLevel(-1)
+        self.vosk = vosk
+        self.model = vosk.Model(model_path) if model_path else vosk.Model(lang=lang)
+
+    def recognize(self, recognizer, audio):
+        raw = audio.get_raw_data(convert_rate=self.SAMPLE_RATE, convert_width=2)
+        kaldi = self.vosk.KaldiRecognizer(self.model, self.SAMPLE_RATE)
+        kaldi.AcceptWaveform(raw)
+        text = json.loads(kaldi.FinalResult()).get('text', '')
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+class PocketSphinxBackend(SpeechBackend):
+    """Offline recognition with PocketSphinx, keeping one decoder for all requests"""
+
+    SAMPLE_RATE = 16000
+
+    def __init__(self, **decoder_options):
+        """
+        Args:
+            decoder_options: Options passed to pocketsphinx.Decoder (e.g. hmm, lm, dict)
+        """
+        try:
+            import pocketsphinx
+        except ImportError as e:
+            raise ImportError("PocketSphinxBackend requires the 'pocketsphinx' package") from e
+        self.decoder = pocketsphinx.Decoder(samprate=self.SAMPLE_RATE, **decoder_options)
+
+    def recognize(self, recognizer, audio):
+        raw = audio.get_raw_data(convert_rate=self.SAMPLE_RATE, convert_width=2)
+        self.decoder.start_utt()
+        self.decoder.process_raw(raw, full_utt=True)
+        self.decoder.end_utt()
+        hypothesis = self.decoder.hyp()
+        if hypothesis is None or not hypothesis.hypstr:
+            raise sr.UnknownValueError()
+        return hypothesis.hypstr
+
+
+BACKENDS = {
+    'google': GoogleBackend,
+    'vosk': VoskBackend,
+    'pocketsphinx': PocketSphinxBackend,
+}
+
+
+def make_backend(name: str, **kwargs) -> SpeechBackend:
+    """Creates a backend by name ('google', 'vosk' or 'pocketsphinx')"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown speech backend: {name}. Available: {sorted(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
+
+
+class SpeechWorker:
+    def __init__(self, backend: Optional[SpeechBackend] = None, timeout: float = 5,
+                 phrase_time_limit: Optional[float] = None):
+        """
+        Records and transcribes speech on a background thread
+
+        Results are put on a queue as (kind, message) tuples, where kind is
+        'status', 'text' or 'error', to be polled from the UI thread.
+
+        Args:
+            backend: Recognizer backend (defaults to GoogleBackend)
+            timeout: Seconds to wait for speech to start
+            phrase_time_limit: Optional maximum length of a phrase in seconds
+        """
+        self.backend = backend or GoogleBackend()
+        self.timeout = timeout
+        self.phrase_time_limit = phrase_time_limit
+        self.recognizer = sr.Recognizer()
+        self.results: "queue.Queue[Tuple[str, str]]" = queue.Queue()
+        self.requests: "queue.Queue[bool]" = queue.Queue()
+        self.calibrated = False
+        self.busy = False
+        self.thread = threading.Thread(target=self._run, name="speech-worker", daemon=True)
+        self.thread.start()
+
+    def request(self) -> bool:
+        """Starts one recording; returns False if a recording is already in progress"""
+        if self.busy:
+            return False
+        self.busy = True
+        self.requests.put(True)
+        return True
+
+    def close(self) -> None:
+        self.requests.put(False)
+
+    def _run(self) -> None:
+        while self.requests.get():
+            try:
+                self.results.put(('text', self._listen_and_recognize()))
+            except sr.WaitTimeoutError:
+                self.results.put(('error', "No speech detected"))
+            except sr.UnknownValueError:
+                self.results.put(('error', "Could not understand audio"))
+            except sr.RequestError:
+                self.results.put(('error', "Could not request results; check your network connection"))
+            except Exception as e:
+                logger.exception("Speech recognition failed")
+                self.results.put(('error', f"Speech recognition failed: {e}"))
+            finally:
+                self.busy = False
+
+    def _listen_and_recognize(self) -> str:
+        with sr.Microphone() as source:
+            # Calibrating once keeps the energy threshold for later requests and saves a second each
+            if not self.calibrated:
+                self.results.put(('status', "Calibrating microphone..."))
+                self.recognizer.adjust_for_ambient_noise(source)
+                self.calibrated = True
+            self.results.put(('status', "Listening... Speak now"))
+            audio = self.recognizer.listen(source, timeout=self.timeout,
+                                           phrase_time_limit=self.phrase_time_limit)
+        self.results.put(('status', "Recognizing..."))
+        return self.backend.recognize(self.recognizer, audio)
@@ -0,0 +1,102 @@
+"""
+On-disk thumbnail cache keyed by path and modification time
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from src.utils.image_io import load_thumbnail
+from src.utils.shards import image_stat
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "image-stats-toolbox" / "thumbnails"
+
+
+class ThumbnailCache:
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        size: Tuple[int, int] = (256, 256),
+        workers: Optional[int] = None,
+        quality: int = 85
+    ):
+        """
+        Caches reduced-size copies of images so repeated reviews skip full decoding
+
+        Args:
+            cache_dir: Directory storing the thumbnails (defaults to ~/.cache/image-stats-toolbox)
+            size: Maximum (width, height) of a thumbnail
+            workers: Number of threads used by get_many (defaults to os.cpu_count())
+            quality: JPEG quality of the stored thumbnails
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.size = tuple(size)
+        self.workers = workers or os.cpu_count() or 4
+        self.quality = quality
+
+    def _cache_path(self, path: str) -> Path:
+        """Cache file for an image; touching the image changes its mtime and thus the key"""
+        size, mtime_ns = image_stat(path)
+        key = f"{os.path.abspath(path)}|{mtime_ns}|{size}|{self.size[0]}x{self.size[1]}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return self.cache_dir / digest[:2] / f"{digest}.jpg"
+
+    def get(self, path: str) -> Image.Image:
+        """Returns the thumbnail of an image, generating and storing it on a miss"""
+        cache_path = self._cache_path(path)
+        if cache_path.exists():
+            try:
+                img = Image.open(cache_path)
+                img.load()
+                return img
+            except OSError:
+                logger.debug(f"Discarding unreadable thumbnail {cache_path}")
+
+        img = load_thumbnail(path, self.size)
+        cache_path.parent.mkdir(exist_ok=True)
+        # Write to a unique temporary file first so concurrent readers never see half
+        # a file and concurrent writers of the same thumbnail never share one
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, format='JPEG', quality=self.quality)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return img
+
+    def get_many(self, paths: List[str]) -> Dict[str, Optional[Image.Image]]:
+        """
+        Returns thumbnails for several images, generating the missing ones in parallel
+
+        Unreadable images map to None.
+        """
+        unique = list(dict.fromkeys(paths))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return dict(zip(unique, executor.map(self._safe_get, unique)))
+
+    def warm(self, paths: List[str]) -> int:
+        """Generates thumbnails ahead of a review and returns how many are available"""
+        unique = list(dict.fromkeys(paths))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return sum(img is not None for img in executor.map(self._safe_get, unique))
+
+    def _safe_get(self, path: str) -> Optional[Image.Image]:
+        try:
+            return self.get(path)
+        except Exception as e:
+            logger.warning(f"Could not create thumbnail for {path}: {e}")
+            return None
@@ -1,41 +1,163 @@
 import matplotlib.pyplot as plt
-from matplotlib.gridspec import GridSpec
-import numpy as np
-from PIL import Image
+from PIL import Image, ImageDraw
+import base64
+import html
+import io
 import random
 import time
-from typing import List, Union
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from src.utils.thumbnails import ThumbnailCache
 
 class DatasetVisualizer:
     @staticmethod
-    def viz(loader, images_per_class: int = 5):
+    def viz(loader, images_per_class: int = 5, cache: Optional[ThumbnailCache] = None,
+            output_path: Optional[str] = None):
         """
         Creates an organized carousel visualization from an ImageLoader instance with random sampling
-        
+
         Args:
             loader: ImageLoader instance containing the dataset
             images_per_class: Number of images to display per class
+            cache: Optional ThumbnailCache reused across calls
+            output_path: Optional .png or .html file to render to instead of opening a window
+        """
+        groups = DatasetVisualizer.sample_groups(loader, images_per_class)
+        DatasetVisualizer.viz_groups(groups, images_per_class, cache=cache, output_path=output_path)
+
+    @staticmethod
+    def viz_groups(groups: Dict[str, List[str]], images_per_class: int = 5,
+                   cache: Optional[ThumbnailCache] = None, output_path: Optional[str] = None,
+                   title: str = "Dataset Overview"):
         """
+        Displays labelled rows of images as a single pre-tiled contact sheet
+
+        Args:
+            groups: Mapping of row label to the image paths shown in that row
+            images_per_class: Number of images per row
+            cache: Optional ThumbnailCache reused across calls
+            output_path: Optional .png or .html file to render to instead of opening a window
+            title: Title of the figure
+        """
+        if output_path:
+            DatasetVisualizer.save_contact_sheet(groups, output_path, images_per_class,
+                                                 cache=cache, title=title)
+            return
+
+        sheet, _ = DatasetVisualizer.contact_sheet(groups, images_per_class, cache=cache)
+        fig = plt.figure(figsize=(15, 15 * sheet.height / sheet.width))
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.imshow(sheet)
+        ax.axis('off')
+        plt.suptitle(title, fontsize=16, y=1.02)
+        plt.show()
+
+    @staticmethod
+    def sample_groups(loader, images_per_class: int = 5) -> Dict[str, List[str]]:
+        """Randomly samples up to images_per_class paths from each class of an ImageLoader"""
         random.seed(time.time())
-        
-        class_names = loader.get_class_names()
-        total_images = len(class_names) * images_per_class
-        
-        fig = plt.figure(figsize=(15, 3 * len(class_names)))
-        gs = GridSpec(len(class_names), images_per_class, figure=fig)
-        
-        for row, class_name in enumerate(class_names):
+        groups = {}
+        for class_name in loader.get_class_names():
             class_images = loader.get_images_by_class(class_name)
-            sampled_images = random.sample(class_images, min(images_per_class, len(class_images)))
-            
-            for col, img_path in enumerate(sampled_images):
-                ax = fig.add_subplot(gs[row, col])
-                img = Image.open(img_path)
-                ax.imshow(img)
-                # Add label under each image
-                ax.set_title(class_name, pad=10)
-                ax.axis('off')
-        
-        plt.suptitle("Dataset Overview", fontsize=16, y=1.02)
-        plt.tight_layout()
-        plt.show()
+            groups[class_name] = random.sample(class_images, min(images_per_class, len(class_images)))
+        return groups
+
+    @staticmethod
+    def contact_sheet(groups: Dict[str, List[str]], images_per_class: int = 5,
+                      cache: Optional[ThumbnailCache] = None,
+                      label_height: int = 24, padding: int = 4
+                      ) -> Tuple[Image.Image, List[Tuple[str, Tuple[int, int, int, int]]]]:
+        """
+        Composites thumbnails of all groups into one image, one labelled block of rows per group
+
+        Args:
+            groups: Mapping of row label to image paths
+            images_per_class: Number of images per line; longer groups wrap
+            cache: ThumbnailCache providing the tiles (a default one is created if omitted)
+            label_height: Height in pixels of the label strip above each row
+            padding: Space in pixels between tiles
+
+        Returns:
+            The contact sheet and the (path, box) of every tile it contains
+        """
+        cache = cache or ThumbnailCache()
+        tile_w, tile_h = cache.size
+        # Long groups wrap onto several lines so whole outlier sets fit on one sheet
+        lines = []
+        for label, paths in groups.items():
+            chunks = [paths[i:i + images_per_class] for i in range(0, len(paths), images_per_class)] or [[]]
+            lines.extend((label if i == 0 else "", chunk) for i, chunk in enumerate(chunks))
+
+        all_paths = [path for _, paths in lines for path in paths]
+        thumbnails = cache.get_many(all_paths)
+
+        row_height = label_height + tile_h + padding
+        width = padding + images_per_class * (tile_w + padding)
+        height = max(1, len(lines)) * row_height + padding
+        sheet = Image.new('RGB', (width, height), 'white')
+        draw = ImageDraw.Draw(sheet)
+        tiles = []
+
+        for row, (label, paths) in enumerate(lines):
+            top = padding + row * row_height
+            draw.text((padding, top + 4), label, fill='black')
+            for col, path in enumerate(paths):
+                left = padding + col * (tile_w + padding)
+                tile_top = top + label_height
+                thumb = thumbnails.get(path)
+                if thumb is None:
+                    # Keep the grid aligned and make unreadable files visible
+                    draw.rectangle([left, tile_top, left + tile_w - 1, tile_top + tile_h - 1], outline='red')
+                    draw.text((left + 4, tile_top + 4), "unreadable", fill='red')
+                else:
+                    # Center the thumbnail inside its tile
+                    x = left + (tile_w - thumb.width) // 2
+                    y = tile_top + (tile_h - thumb.height) // 2
+                    sheet.paste(thumb, (x, y))
+                tiles.append((path, (left, tile_top, left + tile_w, tile_top + tile_h)))
+
+        return sheet, tiles
+
+    @staticmethod
+    def save_contact_sheet(source, output_path: str, images_per_class: int = 5,
+                           cache: Optional[ThumbnailCache] = None,
+                           title: str = "Dataset Overview") -> Path:
+        """
+        Renders a contact sheet straight to a file, without any display
+
+        Args:
+            source: ImageLoader (randomly sampled) or mapping of row label to image paths
+            output_path: Target file; .html embeds the sheet with a tooltip per tile, anything else is saved as an image
+            images_per_class: Number of images per line; longer groups wrap
+            cache: Optional ThumbnailCache reused across calls
+            title: Title of the HTML page
+
+        Returns:
+            Path of the written file
+        """
+        groups = source if isinstance(source, dict) else DatasetVisualizer.sample_groups(source, images_per_class)
+        sheet, tiles = DatasetVisualizer.contact_sheet(groups, images_per_class, cache=cache)
+
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if output_path.suffix.lower() not in ('.html', '.htm'):
+            sheet.save(output_path)
+            return output_path
+
+        buffer = io.BytesIO()
+        sheet.save(buffer, format='PNG')
+        encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+        areas = "\n".join(
+            f'<area shape="rect" coords="{x1},{y1},{x2},{y2}" '
+            f'href="{html.escape(Path(path).resolve().as_uri())}" title="{html.escape(path)}">'
+            for path, (x1, y1, x2, y2) in tiles
+        )
+        output_path.write_text(
+            f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head>\n"
+            f"<body><h1>{html.escape(title)}</h1>\n"
+            f"<img src=\"data:image/png;base64,{encoded}\" usemap=\"#tiles\">\n"
+            f"<map name=\"tiles\">\n{areas}\n</map>\n</body></html>\n",
+            encoding='utf-8'
+        )
+        return output_path
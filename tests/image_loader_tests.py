@@ -1,5 +1,6 @@
 from src.utils.image_loader import ImageLoader
 from src.utils.visualisation import DatasetVisualizer
+from src.utils.embedding_viz import EmbeddingVisualizer
 from src.utils.feature_extractor import FeatureExtractor
 from src.outliers.ransacnn import RANSACNN
 import logging
@@ -49,10 +50,8 @@ if __name__ == "__main__":
 
     # Visualize detected outliers
     logger.info("\nVisualizing detected outliers...")
-    temp_loader = ImageLoader(loader.root_path)
-    temp_loader.dataset_index = {"outliers": outlier_paths}
-    temp_loader.class_mapping = {"outliers": outlier_paths}
-    DatasetVisualizer.viz(temp_loader, images_per_class=5)
+    DatasetVisualizer.viz_groups({"outliers": outlier_paths[:5]}, images_per_class=5)
+    EmbeddingVisualizer.viz_detector(detector, image_paths=image_paths)
 
     # Remove outliers and verify changes
     logger.info("\nRemoving outliers from dataset...")
@@ -0,0 +1,66 @@
+import json
+
+from src.utils.annotation_journal import AnnotationJournal
+
+
+def _crash(journal):
+    """Stops the writer once queued changes are on disk, without the compaction done by close()"""
+    journal.flush()
+    journal.queue.put(('stop', None, None))
+    journal.writer.join()
+    journal.journal_file.close()
+
+
+def test_changes_are_replayed_on_reopen(tmp_path):
+    journal = AnnotationJournal(str(tmp_path))
+    journal.record('/data/a/1.jpg', {'text': 'cat'})
+    journal.record('/data/b/1.jpg', {'text': 'dog'})
+    journal.record('/data/a/1.jpg', {'text': 'tabby cat'})
+    journal.record('/data/b/1.jpg', None)
+    _crash(journal)
+
+    assert not journal.snapshot_path.exists()
+    reopened = AnnotationJournal(str(tmp_path))
+    assert reopened.state == {'/data/a/1.jpg': {'text': 'tabby cat'}}
+    reopened.close()
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(tmp_path):
+    journal = AnnotationJournal(str(tmp_path), compact_every=3)
+    expected = {}
+    for i in range(10):
+        journal.record(f'/data/{i}.jpg', {'text': str(i)})
+        expected[f'/data/{i}.jpg'] = {'text': str(i)}
+    journal.flush()
+
+    assert journal.journal_path.read_text().count('\n') == 1
+    with open(journal.snapshot_path) as f:
+        assert len(json.load(f)['annotations']) == 9
+    journal.close()
+
+    assert journal.journal_path.read_text() == ''
+    reopened = AnnotationJournal(str(tmp_path))
+    assert reopened.state == expected
+    reopened.close()
+
+
+def test_truncated_last_line_is_skipped_and_terminated(tmp_path):
+    journal = AnnotationJournal(str(tmp_path))
+    journal.record('/data/1.jpg', {'text': 'one'})
+    _crash(journal)
+
+    # Simulate a crash in the middle of writing a record
+    with open(journal.journal_path, 'a') as f:
+        f.write('{"path": "/data/2.jpg", "annot')
+
+    recovered = AnnotationJournal(str(tmp_path))
+    assert recovered.state == {'/data/1.jpg': {'text': 'one'}}
+    recovered.record('/data/3.jpg', {'text': 'three'})
+    _crash(recovered)
+
+    reopened = AnnotationJournal(str(tmp_path))
+    assert reopened.state == {
+        '/data/1.jpg': {'text': 'one'},
+        '/data/3.jpg': {'text': 'three'}
+    }
+    reopened.close()
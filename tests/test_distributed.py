@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.distributed import LeaseLost, ShardedJob
+from src.utils.feature_job import FeatureExtractionJob
+from src.utils.image_loader import ImageLoader
+from src.utils.pixel_stats import PixelStatsAccumulator, accumulate_paths
+from tests.test_pipeline import StubExtractor
+
+
+class SingleImageStubExtractor(StubExtractor):
+    """StubExtractor with the per-image interface used by FeatureExtractionJob"""
+
+    def extract_features(self, path):
+        return self.load_image(path)
+
+
+class FailingExtractor(StubExtractor):
+    """Loaded as 'tests.test_distributed:FailingExtractor' to make a worker crash"""
+
+    def predict(self, batch):
+        raise RuntimeError("simulated crash")
+
+
+@pytest.fixture
+def loader(tmp_path):
+    rng = np.random.default_rng(0)
+    root = tmp_path / 'data'
+    for class_name in ('a', 'b'):
+        (root / class_name).mkdir(parents=True)
+        for i in range(9):
+            size = (int(rng.integers(6, 16)), int(rng.integers(6, 16)))
+            pixels = rng.integers(0, 256, size=size + (3,), dtype=np.uint8)
+            Image.fromarray(pixels).save(root / class_name / f"img_{i:02d}.png")
+    shutil.copy(root / 'a' / 'img_00.png', root / 'b' / 'copy_of_a.png')
+    loader = ImageLoader(str(root))
+    # Unreadable images, one in the first shard and one in the last
+    for path in (loader.get_all_images()[1], loader.get_all_images()[-2]):
+        with open(path, 'wb') as f:
+            f.write(b'not an image')
+    return loader
+
+
+def _create(tmp_path, loader, **kwargs):
+    options = dict(num_shards=4, extractor='tests.test_pipeline:StubExtractor', batch_size=3)
+    options.update(kwargs)
+    return ShardedJob.create(str(tmp_path / 'job'), loader, **options)
+
+
+def test_merge_matches_a_single_process_run(tmp_path, loader):
+    job = _create(tmp_path, loader)
+    assert job.run_worker('w1') == 4
+    assert job.status() == {'todo': 0, 'claimed': 0, 'done': 4, 'total': 4}
+    summary = job.merge()
+
+    paths = loader.get_all_images()
+    expected = FeatureExtractionJob(SingleImageStubExtractor(), loader, str(tmp_path / 'single'),
+                                    batch_size=5).run()
+    merged_dir = tmp_path / 'job' / 'merged'
+    features = np.load(merged_dir / 'features.npy')
+    assert json.loads((merged_dir / 'paths.json').read_text()) == paths
+    np.testing.assert_allclose(features, expected, rtol=1e-5)
+    unreadable = [1, len(paths) - 2]
+    assert summary['features']['failed'] == unreadable
+    assert np.flatnonzero(np.isnan(features).all(axis=1)).tolist() == unreadable
+
+    valid = np.delete(np.asarray(expected), unreadable, axis=0)
+    detector, valid_paths = job.build_detector('mahalanobis')
+    assert valid_paths == [path for i, path in enumerate(paths) if i not in unreadable]
+    np.testing.assert_allclose(detector.mean, valid.mean(axis=0), rtol=1e-5)
+
+
+def test_pixel_stats_and_hashes_are_reduced_over_shards(tmp_path, loader):
+    job = _create(tmp_path, loader, tasks=['stats', 'hashes'])
+    job.run_worker('w1')
+    job.merge()
+    merged_dir = tmp_path / 'job' / 'merged'
+
+    stats = json.loads((merged_dir / 'pixel_stats.json').read_text())
+    expected = PixelStatsAccumulator.from_dict(accumulate_paths(loader.get_all_images())).summary()
+    np.testing.assert_allclose(stats['overall']['mean'], expected['mean'])
+    np.testing.assert_allclose(stats['overall']['std'], expected['std'])
+    assert stats['overall']['n_images'] == expected['n_images']
+    assert set(stats['classes']) == {'a', 'b'}
+
+    hashes = json.loads((merged_dir / 'hashes.json').read_text())
+    assert len(hashes['hashes']) == len(loader.get_all_images()) - 2
+    copy = next(path for path in loader.get_all_images() if path.endswith('copy_of_a.png'))
+    original = copy.replace(os.path.join('b', 'copy_of_a.png'), os.path.join('a', 'img_00.png'))
+    assert sorted(map(sorted, hashes['duplicates'])) == [sorted([original, copy])]
+
+
+def test_stale_claims_are_requeued(tmp_path, loader):
+    job = _create(tmp_path, loader, lease_seconds=60)
+    assert job.claim('w1') == '00000'
+    assert job.claim('w2') == '00001'
+    # w1 stopped heartbeating long ago, w2 is alive
+    os.utime(job.claimed_dir / '00000@w1', (0, 0))
+
+    job.requeue_stale()
+    assert sorted(os.listdir(job.todo_dir)) == ['00000', '00002', '00003']
+    assert os.listdir(job.claimed_dir) == ['00001@w2']
+    assert job.claim('w3') == '00000'
+
+
+def test_failing_worker_hands_its_shard_back(tmp_path, loader):
+    job = _create(tmp_path, loader, extractor='tests.test_distributed:FailingExtractor')
+    with pytest.raises(RuntimeError, match="simulated crash"):
+        job.run_worker('w1')
+
+    assert sorted(os.listdir(job.todo_dir)) == ['00000', '00001', '00002', '00003']
+    assert os.listdir(job.claimed_dir) == []
+    assert job.status()['done'] == 0
+
+
+def test_worker_that_lost_its_lease_leaves_the_shard_to_the_new_owner(tmp_path, loader):
+    job = _create(tmp_path, loader, num_shards=1)
+    shard_id = job.claim('w1')
+    lost = threading.Event()
+
+    class TakenOverExtractor(StubExtractor):
+        def predict(self, batch):
+            if self.calls == 2:
+                # w1's lease expires mid-shard and w2 processes the requeued shard
+                os.utime(job.claimed_dir / f"{shard_id}@w1", (0, 0))
+                assert job.run_worker('w2') == 1
+            return super().predict(batch)
+
+    with pytest.raises(LeaseLost):
+        job.process_shard(shard_id, TakenOverExtractor(), worker_id='w1', lost=lost)
+
+    assert lost.is_set()
+    assert os.listdir(job.results_dir) == [shard_id]
+    job.merge()
+    expected = np.stack([np.full(6, np.nan) if i in (1, len(loader.get_all_images()) - 2)
+                         else StubExtractor().load_image(path)
+                         for i, path in enumerate(loader.get_all_images())])
+    np.testing.assert_allclose(np.load(tmp_path / 'job' / 'merged' / 'features.npy'), expected, rtol=1e-5)
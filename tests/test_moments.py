@@ -0,0 +1,55 @@
+import numpy as np
+
+from src.utils.moments import RunningMoments
+
+
+def _rows(seed, n=200, dim=5):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, dim)) @ rng.normal(size=(dim, dim)) + rng.normal(size=dim)
+
+
+def test_batched_updates_match_numpy():
+    rows = _rows(0)
+    moments = RunningMoments()
+    for start in range(0, len(rows), 17):
+        moments.update(rows[start:start + 17])
+
+    assert moments.n == len(rows)
+    np.testing.assert_allclose(moments.mean, rows.mean(axis=0))
+    np.testing.assert_allclose(moments.covariance(), np.cov(rows, rowvar=False))
+
+
+def test_merge_matches_moments_of_all_rows():
+    a, b = _rows(1, n=50), _rows(2, n=130)
+    merged = RunningMoments().update(a).merge(RunningMoments().update(b))
+    rows = np.vstack([a, b])
+
+    np.testing.assert_allclose(merged.mean, rows.mean(axis=0))
+    np.testing.assert_allclose(merged.covariance(), np.cov(rows, rowvar=False))
+
+
+def test_merge_with_empty_accumulators():
+    rows = _rows(3)
+    moments = RunningMoments().merge(RunningMoments().update(rows)).merge(RunningMoments())
+    np.testing.assert_allclose(moments.covariance(), np.cov(rows, rowvar=False))
+
+
+def test_rows_with_nan_are_skipped():
+    rows = _rows(4)
+    with_nan = rows.copy()
+    with_nan[[3, 50, 199]] = np.nan
+    moments = RunningMoments().update(with_nan)
+    finite = np.delete(rows, [3, 50, 199], axis=0)
+
+    assert moments.n == len(finite)
+    np.testing.assert_allclose(moments.covariance(), np.cov(finite, rowvar=False))
+
+
+def test_save_and_load_round_trip(tmp_path):
+    moments = RunningMoments().update(_rows(5))
+    moments.save(str(tmp_path / "moments.npz"))
+    loaded = RunningMoments.load(str(tmp_path / "moments.npz"))
+
+    assert loaded.n == moments.n
+    np.testing.assert_allclose(loaded.mean, moments.mean)
+    np.testing.assert_allclose(loaded.covariance(), moments.covariance())
@@ -0,0 +1,126 @@
+import json
+import logging
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.pipeline import Pipeline, load_config
+from src.utils.feature_job import FeatureExtractionJob, PipelinedFeatureExtractionJob
+from src.utils.image_io import open_image
+from src.utils.image_loader import ImageLoader
+from src.utils.moments import RunningMoments
+
+
+class StubExtractor:
+    """Channel means and standard deviations of an image, loaded as 'tests.test_pipeline:StubExtractor'"""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def load_image(self, path):
+        pixels = np.asarray(open_image(path), dtype=np.float32)
+        return np.concatenate([pixels.mean(axis=(0, 1)), pixels.std(axis=(0, 1))])
+
+    def predict(self, batch):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("simulated crash")
+        return np.asarray(batch, dtype=np.float32)
+
+
+def _write_image(path, rng):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)).save(path)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    rng = np.random.default_rng(0)
+    for class_name in ('a', 'b', 'c'):
+        for i in range(12):
+            _write_image(tmp_path / 'data' / class_name / f"img_{i:02d}.png", rng)
+    return tmp_path / 'data'
+
+
+@pytest.fixture
+def config_path(tmp_path, dataset):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps({
+        'output_dir': str(tmp_path / 'out'),
+        'scan': {'root': str(dataset)},
+        'extract': {'extractor': 'tests.test_pipeline:StubExtractor', 'batch_size': 4, 'decode_workers': 2},
+        'detect': {'method': 'mahalanobis', 'threshold': 2.5},
+        'act': {'contact_sheet': None}
+    }))
+    return path
+
+
+def _run(config, caplog, **kwargs):
+    """Runs the pipeline and returns the stages that were not skipped"""
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger='src.pipeline'):
+        Pipeline(config, **kwargs).run()
+    return [record.getMessage().split()[-1] for record in caplog.records
+            if record.getMessage().startswith('Running stage')]
+
+
+def test_second_run_skips_every_stage(config_path, caplog):
+    config = load_config(str(config_path))
+    assert _run(config, caplog) == ['scan', 'extract', 'detect', 'act']
+    assert _run(config, caplog) == []
+
+
+def test_config_change_reruns_the_stage_and_downstream(config_path, caplog):
+    config = load_config(str(config_path))
+    _run(config, caplog)
+    config['detect']['threshold'] = 3.0
+    assert _run(config, caplog) == ['detect', 'act']
+
+
+def test_new_image_invalidates_every_stage(config_path, dataset, caplog):
+    config = load_config(str(config_path))
+    _run(config, caplog)
+    _write_image(dataset / 'a' / 'img_new.png', np.random.default_rng(1))
+    assert _run(config, caplog) == ['scan', 'extract', 'detect', 'act']
+
+
+def test_force_reruns_the_stage_and_downstream(config_path, caplog):
+    config = load_config(str(config_path))
+    _run(config, caplog)
+    assert _run(config, caplog, force=['extract']) == ['extract', 'detect', 'act']
+
+
+def test_moving_outliers_does_not_invalidate_the_next_run(config_path, tmp_path, caplog):
+    config = load_config(str(config_path))
+    config['detect']['threshold'] = 2.0
+    config['act'].update(action='move', move_to=str(tmp_path / 'moved'), confirm=False)
+
+    _run(config, caplog)
+    moved = sorted(p for p in (tmp_path / 'moved').rglob('*') if p.is_file())
+    assert moved
+    assert _run(config, caplog) == []
+    assert sorted(p for p in (tmp_path / 'moved').rglob('*') if p.is_file()) == moved
+
+
+def test_resumed_pipelined_job_replays_moments(dataset, tmp_path):
+    loader = ImageLoader(str(dataset))
+    output_dir = str(tmp_path / 'features')
+
+    interrupted = PipelinedFeatureExtractionJob(StubExtractor(fail_after=3), loader, output_dir,
+                                                batch_size=4, checkpoint_every=1)
+    with pytest.raises(RuntimeError, match="simulated crash"):
+        interrupted.run()
+    completed = FeatureExtractionJob.load(output_dir)['completed']
+    assert 0 < completed < len(loader.get_all_images())
+
+    moments = RunningMoments()
+    features = PipelinedFeatureExtractionJob(StubExtractor(), loader, output_dir, batch_size=4,
+                                             on_batch=lambda start, rows: moments.update(rows)).run()
+
+    expected = np.stack([StubExtractor().load_image(path) for path in loader.get_all_images()])
+    np.testing.assert_allclose(features, expected, rtol=1e-5)
+    assert moments.n == len(expected)
+    np.testing.assert_allclose(moments.mean, expected.mean(axis=0), rtol=1e-5)
+    np.testing.assert_allclose(moments.covariance(), np.cov(expected, rowvar=False), rtol=1e-4)
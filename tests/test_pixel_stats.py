@@ -0,0 +1,68 @@
+from statistics import NormalDist
+
+import numpy as np
+
+from src.utils.pixel_stats import PixelStatsAccumulator
+
+
+def _images(seed, count=40):
+    """Images of varied sizes whose brightness depends on their size"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        height, width = rng.integers(4, 40, size=2)
+        level = 40 + 4 * height
+        images.append(rng.normal(level, 30, size=(height, width, 3)).clip(0, 255).astype(np.uint8))
+    return images
+
+
+def test_chunked_merge_matches_a_single_pass():
+    images = _images(0)
+    merged = PixelStatsAccumulator()
+    for start in range(0, len(images), 7):
+        chunk = PixelStatsAccumulator()
+        for img in images[start:start + 7]:
+            chunk.update(img)
+        merged.merge(PixelStatsAccumulator.from_dict(chunk.to_dict()))
+
+    pixels = np.concatenate([img.reshape(-1, 3) for img in images]).astype(np.float64)
+    summary = merged.summary()
+    assert summary['n_images'] == len(images)
+    assert summary['n_pixels'] == len(pixels)
+    np.testing.assert_allclose(summary['mean'], pixels.mean(axis=0))
+    np.testing.assert_allclose(summary['std'], pixels.std(axis=0))
+    assert summary['min'] == pixels.min(axis=0).tolist()
+    assert summary['max'] == pixels.max(axis=0).tolist()
+    expected_histogram = [np.bincount(pixels[:, c].astype(int), minlength=256).tolist() for c in range(3)]
+    assert summary['histogram'] == expected_histogram
+
+
+def test_confidence_bounds_use_the_ratio_estimator_variance():
+    images = _images(1)
+    accumulator = PixelStatsAccumulator()
+    for img in images:
+        accumulator.update(img)
+    summary = accumulator.summary(confidence=0.9)
+
+    counts = np.array([img.shape[0] * img.shape[1] for img in images], dtype=np.float64)
+    means = np.stack([img.reshape(-1, 3).mean(axis=0) for img in images])
+    ratio = (counts[:, None] * means).sum(axis=0) / counts.sum()
+    k = len(images)
+    variance = ((counts[:, None] * (means - ratio)) ** 2).sum(axis=0) / (k - 1) / (k * counts.mean() ** 2)
+    half_width = NormalDist().inv_cdf(0.95) * np.sqrt(variance)
+
+    np.testing.assert_allclose(summary['mean'], ratio)
+    np.testing.assert_allclose(np.subtract(summary['mean'], summary['mean_lower']), half_width)
+    np.testing.assert_allclose(np.subtract(summary['mean_upper'], summary['mean']), half_width)
+
+
+def test_finite_population_correction_narrows_the_bounds():
+    accumulator = PixelStatsAccumulator()
+    for img in _images(2):
+        accumulator.update(img)
+    full = accumulator.summary()
+    sampled = accumulator.summary(population=80)
+
+    width = np.subtract(full['mean_upper'], full['mean_lower'])
+    sampled_width = np.subtract(sampled['mean_upper'], sampled['mean_lower'])
+    np.testing.assert_allclose(sampled_width, width * np.sqrt((80 - 40) / (80 - 1)))
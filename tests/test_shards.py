@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from src.utils.shards import (
+    INDEX_SUFFIX, ShardReader, image_stat, pack_images, read_bytes, split_shard_path
+)
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """Files of varied sizes, including an empty one and names too long for a plain ustar header"""
+    root = tmp_path / 'data'
+    files = {
+        'a/small.jpg': b'\xff\xd8small',
+        'a/empty.jpg': b'',
+        'a/block.jpg': bytes(range(256)) * 2,  # exactly one tar block
+        'b/' + 'long_' * 40 + '.jpg': os.urandom(1500),
+        'b/' + 'nested_' * 20 + '/c/deep.png': os.urandom(3000),
+    }
+    paths = []
+    for name, data in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        paths.append(str(path))
+    return root, paths
+
+
+def test_round_trip_by_offset_and_sequentially(tmp_path, sources):
+    root, paths = sources
+    shard_paths = pack_images(paths, str(root), str(tmp_path / 'shards'), max_images=2)
+    assert len(shard_paths) == 3
+
+    packed = {}
+    for shard_path in shard_paths:
+        for member, data in ShardReader(shard_path):
+            packed[os.path.join(shard_path, *member.split('/'))] = data
+    assert len(packed) == len(paths)
+
+    for source in paths:
+        relative = os.path.relpath(source, root)
+        matches = [virtual for virtual in packed if virtual.endswith(os.sep + relative)]
+        assert len(matches) == 1
+        virtual = matches[0]
+        expected = open(source, 'rb').read()
+        assert read_bytes(virtual) == expected
+        assert packed[virtual] == expected
+        assert image_stat(virtual)[0] == len(expected)
+
+
+def test_offsets_rebuilt_from_tar_headers(tmp_path, sources):
+    root, paths = sources
+    shard_path, = pack_images(paths, str(root), str(tmp_path / 'shards'))
+    written = ShardReader(shard_path).members
+    os.remove(shard_path + INDEX_SUFFIX)
+    assert ShardReader(shard_path).members == written
+
+
+def test_virtual_path_parsing(tmp_path, sources):
+    root, paths = sources
+    shard_path, = pack_images(paths, str(root), str(tmp_path / 'shards'))
+
+    assert split_shard_path(os.path.join(shard_path, 'a', 'small.jpg')) == (shard_path, 'a/small.jpg')
+    assert split_shard_path(paths[0]) is None
+    # A directory whose name ends in .tar is not a shard
+    folder = tmp_path / 'photos.tar' / 'a'
+    folder.mkdir(parents=True)
+    (folder / 'x.jpg').write_bytes(b'x')
+    assert split_shard_path(str(folder / 'x.jpg')) is None
+    assert read_bytes(str(folder / 'x.jpg')) == b'x'
+
+
+def test_missing_member_raises(tmp_path, sources):
+    root, paths = sources
+    shard_path, = pack_images(paths, str(root), str(tmp_path / 'shards'))
+    with pytest.raises(FileNotFoundError):
+        image_stat(os.path.join(shard_path, 'a', 'missing.jpg'))
+
+
+def test_shards_inside_a_directory_named_like_a_shard(tmp_path, sources):
+    root, paths = sources
+    shard_path, = pack_images(paths, str(root), str(tmp_path / 'photos.tar'))
+    virtual = os.path.join(shard_path, 'a', 'small.jpg')
+
+    assert split_shard_path(virtual) == (shard_path, 'a/small.jpg')
+    assert read_bytes(virtual) == b'\xff\xd8small'